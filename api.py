@@ -6,6 +6,7 @@ import os.path
 from fastapi import FastAPI
 
 from app.fastapi_extends.responses import JSONResponse
+from app.utils import enable_queue_logging
 
 
 def parse_args():
@@ -16,6 +17,7 @@ def parse_args():
     parser.add_argument('--desc', type=str, default='OpenSPG API Server')
     parser.add_argument('--openspg-service', type=str, default='http://127.0.0.1:8887')
     parser.add_argument('--openspg-modules', action="store", type=str, nargs='*', default=[])
+    parser.add_argument('--project-refresh-interval', type=float, default=300, help='project list refresh interval in seconds')
     return parser.parse_args()
 
 
@@ -23,6 +25,9 @@ def init_app(args):
     os.environ['KAG_PROJECT_ID'] = '0'
     os.environ['KAG_PROJECT_HOST_ADDR'] = args.openspg_service
 
+    # write logs from a background thread, so that the event loop never blocks on stderr
+    enable_queue_logging()
+
     # write_fake_config(os.path.join(os.path.dirname(__file__), 'kag_config.yaml'), args.openspg_service)
 
     kag_version = importlib.metadata.version('openspg-kag')
@@ -1,6 +1,7 @@
 import json
 from typing import Any, Mapping, Optional
 
+import orjson
 from fastapi.responses import Response
 from starlette.background import BackgroundTask
 
@@ -35,3 +36,19 @@ class JSONResponse(Response):
             separators=(",", ":"),
             cls=JSONEncode
         ).encode("utf-8")
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered by orjson, keeps the empty fields removal
+    """
+
+    # types orjson cannot serialize fall back to JSONEncode.default, same as JSONResponse
+    _encoder = JSONEncode()
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            remove_empty_fields(content),
+            default=self._encoder.default,
+            option=orjson.OPT_NON_STR_KEYS
+        )
@@ -2,5 +2,5 @@
 知识图谱数据访问模块 - 提供对OpenSPG知识图谱的直接访问
 """
 
-from app.graphapi.graph_service import GraphService
+from app.graphapi.graph_service import GraphService, GraphNotFound, QueryError
 from app.graphapi.graph_api import mount_routes
@@ -3,18 +3,42 @@
 提供REST API来访问知识图谱数据
 """
 
+import asyncio
 import logging
 from typing import Dict, List, Any, Optional
 
-from fastapi import APIRouter, Depends, Query, Path, HTTPException
+import orjson
+from fastapi import APIRouter, Depends, Query, Path, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
-from app.graphapi.graph_service import get_graph_service
+from app.fastapi_extends.responses import ORJSONResponse
+from app.graphapi.graph_service import (
+    GraphNotFound,
+    GraphService,
+    QueryError,
+    get_graph_service,
+)
 from app.utils import get_open_spg_address
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# /types接口支持的类型类别
+TYPE_CATEGORIES = ("ENTITY", "CONCEPT", "RELATION")
+
+
+def get_app_graph_service(request: Request) -> GraphService:
+    """
+    获取应用启动时创建的图服务实例
+    """
+    graph_service = getattr(request.app.state, "graph_service", None)
+    if graph_service is None:
+        # 启动时创建失败(如OpenSPG服务未就绪)，回退到按需创建
+        graph_service = get_graph_service(get_open_spg_address())
+        request.app.state.graph_service = graph_service
+    return graph_service
+
 
 class GraphInfo(BaseModel):
     """知识图谱基本信息"""
@@ -67,14 +91,23 @@ class QueryResponse(BaseModel):
     columns: List[str] = Field(default_factory=list)
 
 
+def trusted_response(model: BaseModel) -> ORJSONResponse:
+    """
+    直接序列化由受信任数据构造的响应模型
+
+    图服务返回的数据无需再次校验，模型通过model_construct构造，
+    这里直接返回Response，跳过FastAPI对response_model的校验
+    """
+    return ORJSONResponse(dict(model))
+
+
 @router.get("/graphs", response_model=List[GraphInfo], tags=["Knowledge Graph"])
 async def list_graphs(
-    openspg_service: str = Depends(get_open_spg_address),
+    graph_service: GraphService = Depends(get_app_graph_service),
 ):
     """
     获取所有可用的知识图谱列表
     """
-    graph_service = get_graph_service(openspg_service)
     projects = graph_service.get_projects()
 
     result = []
@@ -89,20 +122,56 @@ async def list_graphs(
 )
 async def get_graph_schema(
     graph_id: str = Path(..., description="知识图谱ID或名称"),
-    openspg_service: str = Depends(get_open_spg_address),
+    graph_service: GraphService = Depends(get_app_graph_service),
 ):
     """
     获取指定知识图谱的Schema信息
     """
-    graph_service = get_graph_service(openspg_service)
-    schema = graph_service.get_schema(graph_id)
+    schema = await asyncio.to_thread(graph_service.get_schema, graph_id)
 
     if not schema:
         raise HTTPException(
             status_code=404, detail=f"Graph {graph_id} not found or has no schema"
         )
 
-    return GraphSchema(**schema)
+    return trusted_response(
+        GraphSchema.model_construct(
+            types=schema.get("types", []), properties=schema.get("properties", [])
+        )
+    )
+
+
+@router.get(
+    "/graphs/{graph_id}/types",
+    response_model=Dict[str, List[str]],
+    tags=["Knowledge Graph"],
+)
+async def get_types(
+    graph_id: str = Path(..., description="知识图谱ID或名称"),
+    categories: str = Query(
+        "ENTITY,CONCEPT,RELATION",
+        description="类型类别，逗号分隔，可选值为ENTITY/CONCEPT/RELATION",
+    ),
+    graph_service: GraphService = Depends(get_app_graph_service),
+):
+    """
+    一次请求获取指定知识图谱多个类别的类型列表
+    """
+    requested = []
+    for category in categories.split(","):
+        category = category.strip().upper()
+        if category and category not in requested:
+            requested.append(category)
+
+    invalid = [c for c in requested if c not in TYPE_CATEGORIES]
+    if invalid:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown type categories: {', '.join(invalid)}"
+        )
+
+    return await asyncio.to_thread(
+        graph_service.get_types_by_categories, graph_id, requested
+    )
 
 
 @router.get(
@@ -112,13 +181,12 @@ async def get_graph_schema(
 )
 async def get_entity_types(
     graph_id: str = Path(..., description="知识图谱ID或名称"),
-    openspg_service: str = Depends(get_open_spg_address),
+    graph_service: GraphService = Depends(get_app_graph_service),
 ):
     """
     获取指定知识图谱的所有实体类型
     """
-    graph_service = get_graph_service(openspg_service)
-    types = graph_service.get_entity_types(graph_id)
+    types = await asyncio.to_thread(graph_service.get_entity_types, graph_id)
 
     return types
 
@@ -130,13 +198,12 @@ async def get_entity_types(
 )
 async def get_concept_types(
     graph_id: str = Path(..., description="知识图谱ID或名称"),
-    openspg_service: str = Depends(get_open_spg_address),
+    graph_service: GraphService = Depends(get_app_graph_service),
 ):
     """
     获取指定知识图谱的所有概念类型
     """
-    graph_service = get_graph_service(openspg_service)
-    types = graph_service.get_concept_types(graph_id)
+    types = await asyncio.to_thread(graph_service.get_concept_types, graph_id)
 
     return types
 
@@ -148,13 +215,12 @@ async def get_concept_types(
 )
 async def get_relation_types(
     graph_id: str = Path(..., description="知识图谱ID或名称"),
-    openspg_service: str = Depends(get_open_spg_address),
+    graph_service: GraphService = Depends(get_app_graph_service),
 ):
     """
     获取指定知识图谱的所有关系类型
     """
-    graph_service = get_graph_service(openspg_service)
-    types = graph_service.get_relation_types(graph_id)
+    types = await asyncio.to_thread(graph_service.get_relation_types, graph_id)
 
     return types
 
@@ -169,22 +235,57 @@ async def get_entities(
     entity_type: str = Query(..., description="实体类型"),
     limit: int = Query(100, description="最大返回数量"),
     offset: int = Query(0, description="偏移量"),
-    openspg_service: str = Depends(get_open_spg_address),
+    graph_service: GraphService = Depends(get_app_graph_service),
 ):
     """
     获取指定类型的实体列表
     """
-    graph_service = get_graph_service(openspg_service)
-    entities = graph_service.get_entities(graph_id, entity_type, limit, offset)
-
-    return EntityListResponse(
-        entities=entities,
-        total=len(entities),  # 实际场景中应该返回总数
-        page=(offset // limit) + 1,
-        page_size=limit,
+    try:
+        entities = await asyncio.to_thread(
+            graph_service.get_entities, graph_id, entity_type, limit, offset
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return trusted_response(
+        EntityListResponse.model_construct(
+            entities=entities,
+            total=len(entities),  # 实际场景中应该返回总数
+            page=(offset // limit) + 1,
+            page_size=limit,
+        )
     )
 
 
+@router.get(
+    "/graphs/{graph_id}/entities/stream",
+    response_class=StreamingResponse,
+    tags=["Knowledge Graph"],
+)
+async def stream_entities(
+    graph_id: str = Path(..., description="知识图谱ID或名称"),
+    entity_type: str = Query(..., description="实体类型"),
+    limit: int = Query(100, description="最大返回数量"),
+    offset: int = Query(0, description="偏移量"),
+    graph_service: GraphService = Depends(get_app_graph_service),
+):
+    """
+    以NDJSON格式流式返回指定类型的实体列表，每行一个实体
+    """
+
+    try:
+        entities = graph_service.iter_entities(graph_id, entity_type, limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def generate():
+        for entity in entities:
+            yield orjson.dumps(entity) + b"\n"
+
+    # 同步生成器由Starlette放到线程池中迭代，不会阻塞事件循环
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
 @router.get(
     "/graphs/{graph_id}/search", response_model=SearchResponse, tags=["Knowledge Graph"]
 )
@@ -192,15 +293,18 @@ async def search_entities(
     graph_id: str = Path(..., description="知识图谱ID或名称"),
     keyword: str = Query(..., description="搜索关键词"),
     limit: int = Query(100, description="最大返回数量"),
-    openspg_service: str = Depends(get_open_spg_address),
+    graph_service: GraphService = Depends(get_app_graph_service),
 ):
     """
     搜索实体
     """
-    graph_service = get_graph_service(openspg_service)
-    results = graph_service.search_entities(graph_id, keyword, limit)
+    results = await asyncio.to_thread(
+        graph_service.search_entities, graph_id, keyword, limit
+    )
 
-    return SearchResponse(results=results, total=len(results))
+    return trusted_response(
+        SearchResponse.model_construct(results=results, total=len(results))
+    )
 
 
 @router.get(
@@ -214,15 +318,21 @@ async def get_entity_relations(
     direction: str = Query(
         "BOTH", description="关系方向，可选值为OUTGOING/INCOMING/BOTH"
     ),
-    openspg_service: str = Depends(get_open_spg_address),
+    graph_service: GraphService = Depends(get_app_graph_service),
 ):
     """
     获取实体的关系
     """
-    graph_service = get_graph_service(openspg_service)
-    relations = graph_service.get_entity_relations(graph_id, entity_id, direction)
+    try:
+        relations = await asyncio.to_thread(
+            graph_service.get_entity_relations, graph_id, entity_id, direction
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    return RelationListResponse(relations=relations, total=len(relations))
+    return trusted_response(
+        RelationListResponse.model_construct(relations=relations, total=len(relations))
+    )
 
 
 @router.post(
@@ -230,20 +340,25 @@ async def get_entity_relations(
 )
 async def execute_query(
     graph_id: str = Path(..., description="知识图谱ID或名称"),
-    openspg_service: str = Depends(get_open_spg_address),
+    graph_service: GraphService = Depends(get_app_graph_service),
     query_request: QueryRequest = None,
 ):
     """
     执行自定义SPG DSL查询
     """
-    graph_service = get_graph_service(openspg_service)
-    result = graph_service.execute_query(graph_id, query_request.query)
-
-    if "error" in result:
-        raise HTTPException(status_code=400, detail=result["error"])
-
-    return QueryResponse(
-        records=result.get("records", []), columns=result.get("columns", [])
+    try:
+        result = await asyncio.to_thread(
+            graph_service.execute_query, graph_id, query_request.query
+        )
+    except GraphNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return trusted_response(
+        QueryResponse.model_construct(
+            records=result.get("records", []), columns=result.get("columns", [])
+        )
     )
 
 
@@ -258,7 +373,21 @@ def mount_routes(app, args):
     prefix = f"{args.servlet}/graph"
 
     # 注册路由
-    app.include_router(router, prefix=prefix)
+    app.include_router(router, prefix=prefix, default_response_class=ORJSONResponse)
+
+    @app.on_event("startup")
+    async def init_graph_service():
+        """
+        启动时创建图服务实例并并发预热所有项目的图客户端
+        """
+        try:
+            graph_service = await asyncio.to_thread(
+                get_graph_service, args.openspg_service
+            )
+            app.state.graph_service = graph_service
+            await graph_service.warm_projects(graph_service.get_projects().keys())
+        except Exception as e:
+            logger.warning(f"Failed to initialize graph service: {e}")
 
     logger.info(f"Mounted graph API routes at {prefix}")
     return app
@@ -2,9 +2,14 @@
 知识图谱服务类，提供对OpenSPG知识图谱的直接访问
 """
 
+import asyncio
+import functools
 import json
 import logging
-from typing import Dict, List, Any, Optional, Tuple
+import re
+import threading
+import time
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Tuple
 
 from knext.client.graph_client import GraphClient
 from knext.project.client import ProjectClient
@@ -12,6 +17,75 @@ from kag.common.conf import KAGConstants
 
 logger = logging.getLogger(__name__)
 
+# 实体类型只允许形如 Namespace.TypeName 的标识符，防止DSL注入
+_TYPE_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+# 实体ID会被放入双引号字符串中，不允许出现引号、反斜杠和换行
+_ENTITY_ID_PATTERN = re.compile(r'^[^"\\\r\n]+$')
+
+
+def validate_entity_type(entity_type: str) -> str:
+    """
+    校验实体类型名称，不合法时抛出ValueError
+    """
+    if not entity_type or not _TYPE_NAME_PATTERN.match(entity_type):
+        raise ValueError(f"Invalid entity type: {entity_type!r}")
+    return entity_type
+
+
+def validate_entity_id(entity_id: str) -> str:
+    """
+    校验实体ID，不合法时抛出ValueError
+    """
+    if not entity_id or not _ENTITY_ID_PATTERN.match(entity_id):
+        raise ValueError(f"Invalid entity id: {entity_id!r}")
+    return entity_id
+
+
+@functools.lru_cache(maxsize=1024)
+def _entities_query(entity_type: str, limit: int, offset: int) -> str:
+    """
+    构建按类型分页查询实体的SPG DSL，热点查询直接复用缓存的语句
+    """
+    validate_entity_type(entity_type)
+    if limit < 0 or offset < 0:
+        raise ValueError("limit and offset must be non-negative")
+
+    return f"""
+            MATCH (e:{entity_type})
+            RETURN e
+            LIMIT {limit}
+            OFFSET {offset}
+            """
+
+
+@functools.lru_cache(maxsize=1024)
+def _relations_query(entity_id: str, direction: str) -> str:
+    """
+    构建查询实体关系的SPG DSL，热点查询直接复用缓存的语句
+    """
+    validate_entity_id(entity_id)
+
+    if direction == "OUTGOING":
+        condition = f'id(s) = "{entity_id}"'
+    elif direction == "INCOMING":
+        condition = f'id(o) = "{entity_id}"'
+    else:  # BOTH
+        condition = f'id(s) = "{entity_id}" OR id(o) = "{entity_id}"'
+
+    return f"""
+                MATCH (s)-[r]->(o)
+                WHERE {condition}
+                RETURN s, r, o
+                """
+
+
+class GraphNotFound(Exception):
+    """知识图谱(项目)不存在"""
+
+
+class QueryError(Exception):
+    """SPG DSL查询执行失败"""
+
 
 class GraphService:
     """
@@ -19,25 +93,101 @@ class GraphService:
     提供对OpenSPG知识图谱的直接访问功能
     """
 
-    def __init__(self, service_url: str):
+    # Schema中的类型类别
+    TYPE_CATEGORIES = ("ENTITY_TYPE", "CONCEPT_TYPE", "RELATION_TYPE")
+
+    def __init__(
+        self,
+        service_url: str,
+        schema_ttl: float = 300.0,
+        refresh_interval: float = 30.0,
+    ):
         """
         初始化知识图谱服务
 
         Args:
             service_url: OpenSPG服务地址
+            schema_ttl: Schema缓存有效期(秒)
+            refresh_interval: 遇到未知项目时两次刷新项目列表的最小间隔(秒)
         """
         self.service_url = service_url
+        # 所有knext客户端共用的urllib3连接池，复用连接避免每次RPC重新握手
+        self._pool_manager = None
         self.project_client = ProjectClient(host_addr=service_url, project_id=-1)
+        self._share_connection_pool(self.project_client)
 
         # 加载所有项目
-        logger.info("Loading projects from OpenSPG service")
-        self.project_list = self.project_client.get_all()
-        logger.info(f"Loaded {len(self.project_list)} projects")
-        for project_name, project_id in self.project_list.items():
-            logger.info(f"  - {project_name}: {project_id}")
+        self.project_list: Dict[str, Any] = {}
+        # 规范化的项目ID(字符串)到原始项目ID的映射
+        self._project_ids: Dict[str, Any] = {}
+        # 未知项目触发的刷新按refresh_interval限流，避免每个无效ID都调用一次get_all
+        self.refresh_interval = refresh_interval
+        self._refresh_lock = threading.Lock()
+        self._last_refresh = 0.0
+        self.refresh_projects()
 
         # 项目ID到GraphClient的映射
         self.graph_clients: Dict[str, GraphClient] = {}
+        # 每个项目一把锁，避免并发请求重复创建同一个GraphClient
+        self._clients_lock = threading.Lock()
+        self._client_locks: Dict[str, threading.Lock] = {}
+
+        # 项目ID到(加载时间, Schema)的缓存，加载时间同时作为Schema版本
+        self.schema_ttl = schema_ttl
+        self._schema_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        # 项目ID到(Schema版本, 按类别分组的类型名称)的缓存，类型名称以元组共享
+        self._types_cache: Dict[str, Tuple[float, Dict[str, Tuple[str, ...]]]] = {}
+
+    def _share_connection_pool(self, client):
+        """
+        让knext客户端复用同一个连接池，第一个客户端的连接池作为共享连接池
+
+        Args:
+            client: knext的ProjectClient或GraphClient实例
+        """
+        api_client = getattr(getattr(client, "_rest_client", None), "api_client", None)
+        rest_client = getattr(api_client, "rest_client", None)
+        if rest_client is None or not hasattr(rest_client, "pool_manager"):
+            # 依赖的是knext生成代码的内部属性，knext升级后可能失效
+            logger.warning(
+                f"Cannot share connection pool with {type(client).__name__}, "
+                "knext rest client layout has changed"
+            )
+            return
+
+        if self._pool_manager is None:
+            self._pool_manager = rest_client.pool_manager
+        else:
+            rest_client.pool_manager = self._pool_manager
+
+    def refresh_projects(self):
+        """
+        从OpenSPG服务重新加载所有项目
+        """
+        logger.info("Loading projects from OpenSPG service")
+        project_list = self.project_client.get_all()
+        logger.info(f"Loaded {len(project_list)} projects")
+        for project_name, project_id in project_list.items():
+            logger.debug(f"  - {project_name}: {project_id}")
+
+        self._project_ids = {
+            str(project_id): project_id for project_id in project_list.values()
+        }
+        self.project_list = project_list
+        self._last_refresh = time.monotonic()
+
+    def _refresh_projects_throttled(self) -> bool:
+        """
+        距上次刷新超过refresh_interval时才刷新项目列表
+
+        Returns:
+            bool: 是否执行了刷新
+        """
+        with self._refresh_lock:
+            if time.monotonic() - self._last_refresh < self.refresh_interval:
+                return False
+            self.refresh_projects()
+            return True
 
     def get_projects(self) -> Dict[str, str]:
         """
@@ -58,35 +208,80 @@ class GraphService:
         Returns:
             Optional[GraphClient]: 图客户端实例，如果项目不存在则返回None
         """
-        # 先检查是否已缓存
-        if project_name_or_id in self.graph_clients:
-            return self.graph_clients[project_name_or_id]
+        # 按规范化后的项目ID缓存，名称和ID两种方式查询命中同一个客户端
+        project_id = self._resolve_project_id(project_name_or_id)
+        client = self.graph_clients.get(project_id)
+        if client is not None:
+            return client
 
-        # 如果是项目名，则转换为项目ID
-        project_id = project_name_or_id
-        if project_name_or_id in self.project_list:
-            project_id = self.project_list[project_name_or_id]
+        with self._clients_lock:
+            client_lock = self._client_locks.setdefault(project_id, threading.Lock())
+
+        with client_lock:
+            # 等锁期间可能已被其他线程创建
+            client = self.graph_clients.get(project_id)
+            if client is not None:
+                return client
+
+            # get_all已经确认了项目存在，无需再逐个调用get_by_id；
+            # 未知项目先刷新一次项目列表(按refresh_interval限流)，仍不存在则视为项目不存在
+            if project_id not in self._project_ids:
+                if self._refresh_projects_throttled():
+                    project_id = self._resolve_project_id(project_name_or_id)
+                if project_id not in self._project_ids:
+                    # 不为不存在的项目保留锁，避免任意ID让_client_locks无限增长
+                    with self._clients_lock:
+                        self._client_locks.pop(project_id, None)
+                    logger.warning(f"Project {project_name_or_id} not found")
+                    return None
+
+            # 创建图客户端
+            try:
+                client = GraphClient(
+                    host_addr=self.service_url,
+                    project_id=self._project_ids[project_id],
+                )
+                self._share_connection_pool(client)
+                self.graph_clients[project_id] = client
+                return client
+            except Exception as e:
+                logger.error(
+                    f"Error creating GraphClient for project {project_name_or_id}: {e}"
+                )
+                return None
+
+    async def warm_projects(self, names: Iterable[str]):
+        """
+        并发预热多个项目的图客户端，N个项目的预热耗时约为一次往返
 
-        # 获取项目配置
-        project = self.project_client.get_by_id(project_id)
-        if not project:
-            logger.warning(f"Project {project_name_or_id} not found")
-            return None
+        Args:
+            names: 项目名称或ID列表
+        """
+        names = list(names)
+        clients = await asyncio.gather(
+            *[asyncio.to_thread(self.get_graph_client, name) for name in names],
+            return_exceptions=True,
+        )
+        for name, client in zip(names, clients):
+            if isinstance(client, Exception):
+                logger.warning(f"Failed to warm up project {name}: {client}")
+        logger.info(f"Warmed up {len(names)} projects")
+
+    def _resolve_project_id(self, project_name_or_id: str) -> str:
+        """
+        将项目名称解析为项目ID，用作缓存键
 
-        # 创建图客户端
-        try:
-            client = GraphClient(host_addr=self.service_url, project_id=project_id)
-            self.graph_clients[project_name_or_id] = client
-            return client
-        except Exception as e:
-            logger.error(
-                f"Error creating GraphClient for project {project_name_or_id}: {e}"
-            )
-            return None
+        Args:
+            project_name_or_id: 项目名称或ID
+
+        Returns:
+            str: 项目ID
+        """
+        return str(self.project_list.get(project_name_or_id, project_name_or_id))
 
     def get_schema(self, project_name_or_id: str) -> Dict[str, Any]:
         """
-        获取知识图谱的Schema
+        获取知识图谱的Schema，结果按项目缓存schema_ttl秒
 
         Args:
             project_name_or_id: 项目名称或ID
@@ -94,60 +289,116 @@ class GraphService:
         Returns:
             Dict[str, Any]: Schema定义，如果项目不存在则返回空字典
         """
+        project_id = self._resolve_project_id(project_name_or_id)
+        cached = self._schema_cache.get(project_id)
+        if cached and time.monotonic() - cached[0] < self.schema_ttl:
+            return cached[1]
+
         client = self.get_graph_client(project_name_or_id)
         if not client:
             return {}
 
         try:
-            schema = client.get_schema()
-            return schema or {}
+            schema = client.get_schema() or {}
         except Exception as e:
             logger.error(f"Error getting schema for project {project_name_or_id}: {e}")
             return {}
 
-    def get_entity_types(self, project_name_or_id: str) -> List[str]:
+        self._schema_cache[project_id] = (time.monotonic(), schema)
+        return schema
+
+    def invalidate_schema(self, project_name_or_id: Optional[str] = None):
         """
-        获取所有实体类型
+        使Schema缓存失效
+
+        Args:
+            project_name_or_id: 项目名称或ID，为空时清空所有项目的缓存
+        """
+        if project_name_or_id is None:
+            self._schema_cache.clear()
+            self._types_cache.clear()
+            return
+
+        project_id = self._resolve_project_id(project_name_or_id)
+        self._schema_cache.pop(project_id, None)
+        self._types_cache.pop(project_id, None)
+
+    def _get_types_by_category(
+        self, project_name_or_id: str
+    ) -> Dict[str, Tuple[str, ...]]:
+        """
+        一次遍历Schema，将类型名称按类别分组，结果按Schema版本缓存
 
         Args:
             project_name_or_id: 项目名称或ID
 
         Returns:
-            List[str]: 实体类型列表
+            Dict[str, Tuple[str, ...]]: 类别到类型名称元组的映射，元组在请求间共享
         """
         schema = self.get_schema(project_name_or_id)
-        if not schema:
-            return []
-
-        entity_types = []
+        project_id = self._resolve_project_id(project_name_or_id)
+
+        cached_schema = self._schema_cache.get(project_id)
+        version = cached_schema[0] if cached_schema else None
+        cached = self._types_cache.get(project_id)
+        if cached and version is not None and cached[0] == version:
+            return cached[1]
+
+        buckets: Dict[str, List[str]] = {
+            category: [] for category in self.TYPE_CATEGORIES
+        }
+        get_bucket = buckets.get
         for type_def in schema.get("types", []):
-            if type_def.get("category") == "ENTITY_TYPE":
-                entity_types.append(type_def.get("name"))
+            names = get_bucket(type_def.get("category"))
+            if names is not None:
+                names.append(type_def.get("name"))
+        groups = {category: tuple(names) for category, names in buckets.items()}
+
+        if version is not None:
+            self._types_cache[project_id] = (version, groups)
+        return groups
+
+    def get_types_by_categories(
+        self, project_name_or_id: str, categories: Iterable[str]
+    ) -> Dict[str, Tuple[str, ...]]:
+        """
+        一次Schema查询获取多个类别的类型列表
+
+        Args:
+            project_name_or_id: 项目名称或ID
+            categories: 类别列表，可选值为ENTITY/CONCEPT/RELATION
 
-        return entity_types
+        Returns:
+            Dict[str, Tuple[str, ...]]: 类别到类型名称元组的映射
+        """
+        groups = self._get_types_by_category(project_name_or_id)
+        return {category: groups[f"{category}_TYPE"] for category in categories}
 
-    def get_concept_types(self, project_name_or_id: str) -> List[str]:
+    def get_entity_types(self, project_name_or_id: str) -> Tuple[str, ...]:
         """
-        获取所有概念类型
+        获取所有实体类型
 
         Args:
             project_name_or_id: 项目名称或ID
 
         Returns:
-            List[str]: 概念类型列表
+            Tuple[str, ...]: 实体类型元组
         """
-        schema = self.get_schema(project_name_or_id)
-        if not schema:
-            return []
+        return self._get_types_by_category(project_name_or_id)["ENTITY_TYPE"]
 
-        concept_types = []
-        for type_def in schema.get("types", []):
-            if type_def.get("category") == "CONCEPT_TYPE":
-                concept_types.append(type_def.get("name"))
+    def get_concept_types(self, project_name_or_id: str) -> Tuple[str, ...]:
+        """
+        获取所有概念类型
 
-        return concept_types
+        Args:
+            project_name_or_id: 项目名称或ID
+
+        Returns:
+            Tuple[str, ...]: 概念类型元组
+        """
+        return self._get_types_by_category(project_name_or_id)["CONCEPT_TYPE"]
 
-    def get_relation_types(self, project_name_or_id: str) -> List[str]:
+    def get_relation_types(self, project_name_or_id: str) -> Tuple[str, ...]:
         """
         获取所有关系类型
 
@@ -155,18 +406,18 @@ class GraphService:
             project_name_or_id: 项目名称或ID
 
         Returns:
-            List[str]: 关系类型列表
+            Tuple[str, ...]: 关系类型元组
         """
-        schema = self.get_schema(project_name_or_id)
-        if not schema:
-            return []
+        return self._get_types_by_category(project_name_or_id)["RELATION_TYPE"]
 
-        relation_types = []
-        for type_def in schema.get("types", []):
-            if type_def.get("category") == "RELATION_TYPE":
-                relation_types.append(type_def.get("name"))
-
-        return relation_types
+    @staticmethod
+    def _parse_entities(records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        从查询记录中逐条取出实体
+        """
+        for record in records:
+            if "e" in record:
+                yield record["e"]
 
     def get_entities(
         self,
@@ -187,35 +438,96 @@ class GraphService:
         Returns:
             List[Dict[str, Any]]: 实体列表
         """
+        # 构建SPG DSL查询，参数不合法时直接抛出ValueError
+        query = _entities_query(entity_type, limit, offset)
+
         client = self.get_graph_client(project_name_or_id)
         if not client:
             return []
 
         try:
-            # 构建SPG DSL查询
-            query = f"""
-            MATCH (e:{entity_type})
-            RETURN e
-            LIMIT {limit}
-            OFFSET {offset}
-            """
-
             # 执行查询
             result = client.execute_spg_dsl(query)
 
             # 解析结果
-            entities = []
-            for record in result.get("records", []):
-                if "e" in record:
-                    entities.append(record["e"])
-
-            return entities
+            return list(self._parse_entities(result.get("records", [])))
         except Exception as e:
             logger.error(
                 f"Error getting entities for project {project_name_or_id}, type {entity_type}: {e}"
             )
             return []
 
+    def iter_entities(
+        self,
+        project_name_or_id: str,
+        entity_type: str,
+        limit: int = 100,
+        offset: int = 0,
+        page_size: int = 500,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        逐条产出指定类型的实体，不在内存中物化整个结果列表
+
+        客户端支持execute_spg_dsl_stream时直接使用流式查询，否则按page_size分页查询
+
+        Args:
+            project_name_or_id: 项目名称或ID
+            entity_type: 实体类型
+            limit: 最大返回数量
+            offset: 偏移量
+            page_size: 分页查询时每页的数量
+
+        Returns:
+            Iterator[Dict[str, Any]]: 实体迭代器
+
+        Raises:
+            QueryError: 迭代过程中查询失败，已产出的实体不会撤回
+        """
+        # 在开始迭代前校验参数，参数不合法时直接抛出ValueError
+        _entities_query(entity_type, limit, offset)
+        return self._iter_entities(
+            project_name_or_id, entity_type, limit, offset, page_size
+        )
+
+    def _iter_entities(
+        self,
+        project_name_or_id: str,
+        entity_type: str,
+        limit: int,
+        offset: int,
+        page_size: int,
+    ) -> Iterator[Dict[str, Any]]:
+        client = self.get_graph_client(project_name_or_id)
+        if not client:
+            return
+
+        try:
+            stream = getattr(client, "execute_spg_dsl_stream", None)
+            if stream is not None:
+                query = _entities_query(entity_type, limit, offset)
+                yield from self._parse_entities(stream(query))
+                return
+
+            remaining = limit
+            while remaining > 0:
+                size = min(page_size, remaining)
+                query = _entities_query(entity_type, size, offset)
+                records = client.execute_spg_dsl(query).get("records", [])
+
+                yield from self._parse_entities(records)
+
+                # 最后一页不足一页时结束
+                if len(records) < size:
+                    return
+                remaining -= size
+                offset += size
+        except Exception as e:
+            logger.error(
+                f"Error streaming entities for project {project_name_or_id}, type {entity_type}: {e}"
+            )
+            # 流已经开始输出，必须抛出异常让调用方中断流，不能当作正常结束
+            raise QueryError(str(e)) from e
+
     def search_entities(
         self, project_name_or_id: str, keyword: str, limit: int = 100
     ) -> List[Dict[str, Any]]:
@@ -258,46 +570,27 @@ class GraphService:
         Returns:
             List[Dict[str, Any]]: 关系列表
         """
+        # 构建查询，参数不合法时直接抛出ValueError
+        query = _relations_query(entity_id, direction)
+
         client = self.get_graph_client(project_name_or_id)
         if not client:
             return []
 
         try:
-            # 构建查询
-            if direction == "OUTGOING":
-                query = f"""
-                MATCH (s)-[r]->(o)
-                WHERE id(s) = "{entity_id}"
-                RETURN s, r, o
-                """
-            elif direction == "INCOMING":
-                query = f"""
-                MATCH (s)-[r]->(o)
-                WHERE id(o) = "{entity_id}"
-                RETURN s, r, o
-                """
-            else:  # BOTH
-                query = f"""
-                MATCH (s)-[r]->(o)
-                WHERE id(s) = "{entity_id}" OR id(o) = "{entity_id}"
-                RETURN s, r, o
-                """
-
             # 执行查询
             result = client.execute_spg_dsl(query)
 
             # 解析结果
-            relations = []
-            for record in result.get("records", []):
-                if "r" in record:
-                    relation = {
-                        "relation": record["r"],
-                        "source": record.get("s", {}),
-                        "target": record.get("o", {}),
-                    }
-                    relations.append(relation)
-
-            return relations
+            return [
+                {
+                    "relation": record["r"],
+                    "source": record.get("s", {}),
+                    "target": record.get("o", {}),
+                }
+                for record in result.get("records", [])
+                if "r" in record
+            ]
         except Exception as e:
             logger.error(
                 f"Error getting relations for entity {entity_id} in project {project_name_or_id}: {e}"
@@ -314,21 +607,26 @@ class GraphService:
 
         Returns:
             Dict[str, Any]: 查询结果
+
+        Raises:
+            GraphNotFound: 项目不存在
+            QueryError: 查询执行失败
         """
         client = self.get_graph_client(project_name_or_id)
         if not client:
-            return {"error": f"Project {project_name_or_id} not found"}
+            raise GraphNotFound(f"Project {project_name_or_id} not found")
 
         try:
             result = client.execute_spg_dsl(query)
-            return result or {}
         except Exception as e:
             logger.error(f"Error executing query for project {project_name_or_id}: {e}")
-            return {"error": str(e)}
+            raise QueryError(str(e)) from e
+        return result or {}
 
 
 # 全局服务实例
 graph_service = None
+_graph_service_lock = threading.Lock()
 
 
 def get_graph_service(service_url: str) -> GraphService:
@@ -343,5 +641,7 @@ def get_graph_service(service_url: str) -> GraphService:
     """
     global graph_service
     if graph_service is None:
-        graph_service = GraphService(service_url=service_url)
+        with _graph_service_lock:
+            if graph_service is None:
+                graph_service = GraphService(service_url=service_url)
     return graph_service
@@ -3,6 +3,8 @@ from typing import Optional, List, Literal, Union
 
 from pydantic import BaseModel, Field
 
+from app.openspg.api.openai_api_types._roles import Role
+
 
 class ModelCard(BaseModel):
     id: str
@@ -20,7 +22,7 @@ class ModelList(BaseModel):
 
 
 class ChatMessage(BaseModel):
-    role: Literal['user', 'assistant', 'system', 'function']
+    role: Role
     content: str = None
     name: Optional[str] = None
 
@@ -37,7 +39,7 @@ class ChatCompletionRequest(BaseModel):
 
 
 class DeltaMessage(BaseModel):
-    role: Optional[Literal["user", "assistant", "system"]] = None
+    role: Optional[Role] = None
     content: Optional[str] = None
 
 
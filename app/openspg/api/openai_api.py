@@ -1,14 +1,15 @@
 import asyncio
-import json
 import logging
-import traceback
-from typing import Optional, AsyncGenerator, Any
+import time
+from typing import Optional, AsyncGenerator, AsyncIterator, Any, List
 
+import orjson
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import Response
 from pydantic import BaseModel, Field
 from sse_starlette.sse import EventSourceResponse
 
+from app.fastapi_extends.responses import JSONResponse
 from app.openspg.api.openai_api_types import (
     ChatCompletionRequest,
     ChatCompletion,
@@ -24,6 +25,14 @@ from app.utils import get_open_spg_address
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# 流式分片ID前缀
+CHUNK_ID_PREFIX = "chatcmpl-"
+# 流式输出合并：缓冲的增量内容满该字符数，或等待超过该秒数时发送一个SSE事件
+SSE_FLUSH_SIZE = 64
+SSE_FLUSH_INTERVAL = 0.016
+# 增量内容队列的结束标记
+_STREAM_END = object()
+
 
 class ChatRequest(BaseModel):
     user_id: Optional[str] = Field(None, title="User ID")
@@ -69,196 +78,240 @@ async def create_chat_completion(
         # Get KAG service
         kag_service = get_kag_service(openspg_service)
 
+        # 相同的并发查询共用一次KAG求解，指定了user的个性化请求单独执行
+        if chat_request.user:
+            chunks = kag_service.query(query, project_id)
+        else:
+            chunks = kag_service.coalesced_query(query, project_id)
+
         if stream:
             # 直接返回流式响应
             return EventSourceResponse(
-                stream_generator(kag_service, query, project_id),
+                stream_generator(chunks),
                 media_type="text/event-stream",
             )
         else:
             # 处理非流式请求 - 收集所有结果然后返回完整响应
-            full_response = ""
-            async for chunk in kag_service.query(query, project_id):
-                if isinstance(chunk, str):
+            parts: List[str] = []
+            async for chunk in chunks:
+                # 按类型分派，每个分片只做一次类型判断
+                chunk_type = type(chunk)
+                if chunk_type is str:
                     if chunk.startswith("Error:"):
                         # 处理错误情况
                         raise HTTPException(status_code=500, detail=chunk)
-                    else:
-                        # 处理文本响应
-                        full_response += chunk
-                elif isinstance(chunk, dict):
-                    if "event" in chunk and chunk["event"] == "changed":
+                    # 处理文本响应
+                    parts.append(chunk)
+                elif chunk_type is dict:
+                    data = chunk.get("data")
+                    content = data.get("content") if type(data) is dict else None
+                    if chunk.get("event") == "changed":
                         # 处理中间事件，提取内容添加到响应
-                        if "data" in chunk and "content" in chunk["data"]:
-                            content = chunk["data"]["content"]
-                            # 确保content是字符串
-                            if isinstance(content, str):
-                                full_response += content
-                            elif content is not None:
-                                # 如果不是字符串但有值，转换为字符串
-                                full_response += str(content)
-                    else:
+                        if type(content) is str:
+                            parts.append(content)
+                        elif content is not None:
+                            # 如果不是字符串但有值，转换为字符串
+                            parts.append(str(content))
+                    elif type(content) is str:
                         # 处理其他字典格式响应
-                        if isinstance(chunk.get("data", {}).get("content"), str):
-                            full_response += chunk["data"]["content"]
-                        else:
-                            # 如果无法解析内容，转换为字符串
-                            full_response += str(chunk)
+                        parts.append(content)
+                    else:
+                        # 如果无法解析内容，转换为字符串
+                        parts.append(str(chunk))
                 else:
                     # 处理其他类型的结果
-                    full_response += str(chunk)
+                    parts.append(str(chunk))
+
+            full_response = "".join(parts)
+            prompt_tokens = len(query)
+            completion_tokens = len(full_response)
 
-            # 构建并返回完整响应
-            return ChatCompletion(
+            # 构建并返回完整响应，内容由服务端生成，跳过Pydantic校验
+            completion = ChatCompletion.model_construct(
                 id=f"chatcmpl-{project_id}",
                 object="chat.completion",
+                created=int(time.time()),
                 model=chat_request.model or f"kag-{project_id}",
                 choices=[
-                    ChatCompletionChoice(
+                    ChatCompletionChoice.model_construct(
                         index=0,
-                        message=ChatMessage(role="assistant", content=full_response),
+                        message=ChatMessage.model_construct(
+                            role="assistant", content=full_response
+                        ),
                         finish_reason="stop",
                     )
                 ],
                 usage={
-                    "prompt_tokens": len(query),
-                    "completion_tokens": len(full_response),
-                    "total_tokens": len(query) + len(full_response),
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
                 },
             )
+            return JSONResponse(completion.model_dump())
 
     except Exception as e:
-        logger.error(f"Error in create_chat_completion: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error in create_chat_completion: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class _StreamChunkError(Exception):
+    """KAG以"Error:"开头的文本分片，需要作为错误分片发送给客户端"""
+
+
+async def _pump_deltas(chunks: AsyncIterator[Any], queue: asyncio.Queue):
+    """
+    将KAG输出分片转换为增量文本放入队列，结束时放入_STREAM_END
+
+    Args:
+        chunks: kag_service返回的异步生成器
+        queue: 增量文本队列，出错时放入异常对象
+    """
+    try:
+        # 只记录已发送内容的长度，避免每个分片都复制一次已累计的全文
+        sent_len = 0
+        async for chunk in chunks:
+            # 按类型分派，每个分片只做一次类型判断
+            chunk_type = type(chunk)
+            if chunk_type is dict:
+                if chunk.get("event") == "changed":
+                    # 处理中间事件，提取内容
+                    data = chunk.get("data")
+                    content = data.get("content") if type(data) is dict else None
+                    if content and len(content) > sent_len:
+                        # 只发送增量内容
+                        queue.put_nowait(str(content[sent_len:]))
+                        sent_len = len(content)
+                    continue
+                final_content = str(chunk)
+            elif chunk_type is str:
+                if chunk.startswith("Error:"):
+                    queue.put_nowait(_StreamChunkError(chunk))
+                    return
+                # 字符串无需再转换
+                final_content = chunk
+            else:
+                final_content = str(chunk)
+
+            # 处理最终结果，没有新增内容时不发送空分片
+            if len(final_content) > sent_len:
+                queue.put_nowait(final_content[sent_len:])
+                sent_len = len(final_content)
+    except Exception as e:
+        queue.put_nowait(e)
+    finally:
+        queue.put_nowait(_STREAM_END)
+
+
+def _sse_frame(payload: bytes) -> bytes:
+    """将JSON负载封装为一个完整的SSE事件"""
+    return b"data: " + payload + b"\r\n\r\n"
+
+
 async def stream_generator(
-    kag_service, query: str, project_id: str
-) -> AsyncGenerator[str, None]:
+    chunks: AsyncIterator[Any],
+) -> AsyncGenerator[bytes, None]:
     """
     生成流式响应的异步生成器
+
+    增量内容先缓冲，累计满SSE_FLUSH_SIZE个字符或等待超过SSE_FLUSH_INTERVAL秒时
+    合并为一个SSE事件发送，事件直接以编码好的字节输出
     """
+    # 同一次响应的所有分片共用一个创建时间(Unix时间戳，与OpenAI一致)
+    created = int(time.time())
+    queue: asyncio.Queue = asyncio.Queue()
+    pump = asyncio.create_task(_pump_deltas(chunks, queue))
     try:
+        loop = asyncio.get_running_loop()
         event_id = 0
+        # 所有分片共用同一个信封，每次只替换id、delta和finish_reason后序列化
+        choice = {"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}
+        envelope = {
+            "id": CHUNK_ID_PREFIX + str(event_id),
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": "kag",
+            "choices": [choice],
+        }
+
         # 发送开始事件
-        yield json.dumps(
-            {
-                "id": f"chatcmpl-{event_id}",
-                "object": "chat.completion.chunk",
-                "created": int(asyncio.get_event_loop().time()),
-                "model": "kag",
-                "choices": [
-                    {"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}
-                ],
-            }
-        )
+        yield _sse_frame(orjson.dumps(envelope))
         event_id += 1
 
-        # 直接使用kag_service的异步生成器
-        current_content = ""
-        async for chunk in kag_service.query(query, project_id):
-            # 解析结果
-            if isinstance(chunk, str) and chunk.startswith("Error:"):
-                # 发送错误消息
-                yield json.dumps(
-                    {
-                        "id": f"chatcmpl-{event_id}",
-                        "object": "chat.completion.chunk",
-                        "created": int(asyncio.get_event_loop().time()),
-                        "model": "kag",
-                        "choices": [
-                            {
-                                "index": 0,
-                                "delta": {"content": f"Error: {chunk}"},
-                                "finish_reason": "error",
-                            }
-                        ],
-                    }
-                )
-                break
+        delta = {"content": ""}
+        choice["delta"] = delta
 
-            elif (
-                isinstance(chunk, dict)
-                and "event" in chunk
-                and chunk["event"] == "changed"
-            ):
-                # 处理中间事件，提取内容
-                if "data" in chunk and "content" in chunk["data"]:
-                    content = chunk["data"]["content"]
-                    if content and content != current_content:
-                        # 只发送增量内容
-                        delta = content[len(current_content) :]
-                        current_content = content
-
-                        yield json.dumps(
-                            {
-                                "id": f"chatcmpl-{event_id}",
-                                "object": "chat.completion.chunk",
-                                "created": int(asyncio.get_event_loop().time()),
-                                "model": "kag",
-                                "choices": [
-                                    {
-                                        "index": 0,
-                                        "delta": {"content": delta},
-                                        "finish_reason": None,
-                                    }
-                                ],
-                            }
-                        )
-                        event_id += 1
-            else:
-                # 处理最终结果
-                final_content = str(chunk)
-                if final_content and final_content != current_content:
-                    delta = final_content[len(current_content) :]
-                    yield json.dumps(
-                        {
-                            "id": f"chatcmpl-{event_id}",
-                            "object": "chat.completion.chunk",
-                            "created": int(asyncio.get_event_loop().time()),
-                            "model": "kag",
-                            "choices": [
-                                {
-                                    "index": 0,
-                                    "delta": {"content": delta},
-                                    "finish_reason": None,
-                                }
-                            ],
-                        }
+        pending: List[str] = []
+        pending_size = 0
+        deadline = 0.0
+        while True:
+            if pending:
+                try:
+                    item = await asyncio.wait_for(
+                        queue.get(), max(deadline - loop.time(), 0)
                     )
-                    event_id += 1
+                except asyncio.TimeoutError:
+                    item = None
+            else:
+                item = await queue.get()
+
+            if type(item) is str:
+                if not pending:
+                    deadline = loop.time() + SSE_FLUSH_INTERVAL
+                pending.append(item)
+                pending_size += len(item)
+                if pending_size < SSE_FLUSH_SIZE:
+                    continue
+
+            # 超时、缓冲已满或输出结束时，合并发送缓冲的增量内容
+            if pending:
+                envelope["id"] = CHUNK_ID_PREFIX + str(event_id)
+                delta["content"] = "".join(pending)
+                pending.clear()
+                pending_size = 0
+                yield _sse_frame(orjson.dumps(envelope))
+                event_id += 1
+
+            if item is _STREAM_END:
+                break
+            if isinstance(item, _StreamChunkError):
+                # 发送错误消息
+                envelope["id"] = CHUNK_ID_PREFIX + str(event_id)
+                delta["content"] = f"Error: {item}"
+                choice["finish_reason"] = "error"
+                yield _sse_frame(orjson.dumps(envelope))
+                break
+            if isinstance(item, Exception):
+                raise item
 
         # 发送结束事件
-        yield json.dumps(
-            {
-                "id": f"chatcmpl-{event_id}",
-                "object": "chat.completion.chunk",
-                "created": int(asyncio.get_event_loop().time()),
-                "model": "kag",
-                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
-            }
-        )
+        envelope["id"] = CHUNK_ID_PREFIX + str(event_id)
+        choice["delta"] = {}
+        choice["finish_reason"] = "stop"
+        yield _sse_frame(orjson.dumps(envelope))
 
     except Exception as e:
-        logger.error(f"Error in stream_generator: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error in stream_generator: %s", e)
         # 发送错误消息
-        yield json.dumps(
-            {
-                "id": f"chatcmpl-error",
-                "object": "chat.completion.chunk",
-                "created": int(asyncio.get_event_loop().time()),
-                "model": "kag",
-                "choices": [
-                    {
-                        "index": 0,
-                        "delta": {"content": f"\nError: {str(e)}"},
-                        "finish_reason": "error",
-                    }
-                ],
-            }
+        yield _sse_frame(
+            orjson.dumps(
+                {
+                    "id": CHUNK_ID_PREFIX + "error",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": "kag",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {"content": f"\nError: {str(e)}"},
+                            "finish_reason": "error",
+                        }
+                    ],
+                }
+            )
         )
+    finally:
+        # 客户端断开时停止消费KAG输出
+        pump.cancel()
 
 
 def mount_routes(app, args):
@@ -283,25 +336,13 @@ def mount_routes(app, args):
         """
         try:
             kag_service = get_kag_service(args.openspg_service)
-            projects = kag_service.get_projects()
-
-            logger.info(f"Available models: {list(projects.keys())}")
-
-            return {
-                "object": "list",
-                "data": [
-                    {
-                        "id": f"openspg/{name}",
-                        "object": "model",
-                        "created": int(asyncio.get_event_loop().time()),
-                        "owned_by": "openspg",
-                    }
-                    for name in projects.keys()
-                ],
-            }
+            # 响应体只随项目列表变化，直接返回预先序列化的结果
+            return Response(
+                content=kag_service.get_models_payload(),
+                media_type="application/json",
+            )
         except Exception as e:
-            logger.error(f"Error listing models: {str(e)}")
-            traceback.print_exc()
+            logger.exception("Error listing models: %s", e)
             # 返回至少一些默认模型
             return {
                 "object": "list",
@@ -309,7 +350,7 @@ def mount_routes(app, args):
                     {
                         "id": "openspg/default",
                         "object": "model",
-                        "created": int(asyncio.get_event_loop().time()),
+                        "created": int(time.time()),
                         "owned_by": "openspg",
                     }
                 ],
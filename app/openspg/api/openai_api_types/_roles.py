@@ -0,0 +1,4 @@
+from typing import Literal
+
+# Chat message roles shared by the request and response models
+Role = Literal["user", "assistant", "system", "function"]
@@ -1,14 +1,20 @@
-from typing import List, Optional, Union, Literal
-from pydantic import BaseModel, Field
+from typing import List, Optional, Union
+from pydantic import BaseModel, ConfigDict, Field
+
+from app.openspg.api.openai_api_types._roles import Role
 
 
 class ChatMessage(BaseModel):
-    role: Literal["user", "assistant", "system", "function"]
+    model_config = ConfigDict(extra="ignore", populate_by_name=True)
+
+    role: Role
     content: str = None
     name: Optional[str] = None
 
 
 class ChatCompletionRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore", populate_by_name=True)
+
     model: str
     messages: List[ChatMessage]
     temperature: Optional[float] = 0.8
@@ -18,3 +24,4 @@ class ChatCompletionRequest(BaseModel):
     tools: Optional[Union[dict, List[dict]]] = None
     repetition_penalty: Optional[float] = 1.1
     project_id: Optional[str] = Field(None, title="Target project ID")
+    user: Optional[str] = Field(None, title="End-user ID, disables query coalescing")
@@ -1,11 +1,15 @@
 import time
 from typing import List, Optional, Literal, Dict, Any, Union
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+
+from app.openspg.api.openai_api_types._roles import Role
 
 
 class ChatMessage(BaseModel):
-    role: Literal["user", "assistant", "system", "function"]
+    model_config = ConfigDict(extra="ignore", populate_by_name=True)
+
+    role: Role
     content: str = None
     name: Optional[str] = None
 
@@ -26,7 +30,7 @@ class ChatCompletion(BaseModel):
 
 
 class DeltaMessage(BaseModel):
-    role: Optional[Literal["user", "assistant", "system"]] = None
+    role: Optional[Role] = None
     content: Optional[str] = None
 
 
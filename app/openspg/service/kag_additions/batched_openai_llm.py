@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import threading
+import weakref
+from typing import Optional, List, Tuple, Set
+
+from kag.interface import LLMClient
+from openai import AsyncOpenAI, OpenAI
+
+logger = logging.getLogger()
+
+
+class _PendingBatch:
+    """单个事件循环中等待发送的调用，只在该循环所在的线程中访问"""
+
+    def __init__(self):
+        # 等待发送的(prompt, future)，以及凑批计时器
+        self.items: List[Tuple[str, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # 正在发送的批次，保持引用避免任务被回收
+        self.tasks: Set[asyncio.Task] = set()
+
+
+@LLMClient.register("batched_openai_llm")
+class BatchedOpenAIClient(LLMClient):
+    """
+    批量OpenAI客户端，将并发的非流式调用合并为一次批量请求
+
+    适用于KAG流水线中的分类、抽取等非流式子调用，流式生成请使用stream_openai_llm
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str,
+        model: str,
+        temperature: float = 0.0,
+        max_tokens: int = 1024,
+        timeout: int = 60,
+        max_batch_size: int = 16,
+        batch_wait_timeout_s: float = 0.05,
+        **kwargs,
+    ):
+        """
+        初始化批量OpenAI客户端
+
+        Args:
+            api_key: API密钥
+            base_url: API基础URL
+            model: 模型名称，需支持completions接口的多prompt请求
+            temperature: 温度参数
+            max_tokens: 每个prompt的最大输出长度
+            timeout: 请求超时时间(秒)
+            max_batch_size: 每批最多合并的prompt数量
+            batch_wait_timeout_s: 凑批的最长等待时间(秒)
+        """
+        name = kwargs.pop("name", None)
+        if not name:
+            name = "batched_openai_llm"
+
+        super().__init__(name=name, **kwargs)
+
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.batch_wait_timeout_s = batch_wait_timeout_s
+
+        self.client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout)
+        self.async_client = AsyncOpenAI(
+            api_key=api_key, base_url=base_url, timeout=timeout
+        )
+
+        # 每个事件循环各自凑批，future和计时器都不跨循环使用
+        self._pending: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._pending_lock = threading.Lock()
+
+        logger.info(
+            f"Initialized BatchedOpenAIClient with model: {model}, "
+            f"max_batch_size: {max_batch_size}, batch_wait_timeout_s: {batch_wait_timeout_s}"
+        )
+
+    def __call__(self, prompt: str, **kwargs) -> str:
+        """
+        同步调用LLM模型，单独发送请求
+
+        Args:
+            prompt: 用户输入文本
+
+        Returns:
+            模型输出的文本
+        """
+        response = self.client.completions.create(
+            model=self.model,
+            prompt=prompt,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+        )
+        return response.choices[0].text
+
+    async def acall(self, prompt: str, **kwargs) -> str:
+        """
+        异步调用LLM模型，与同一时间窗口内的其他调用合并发送
+
+        Args:
+            prompt: 用户输入文本
+
+        Returns:
+            模型输出的文本
+        """
+        if not isinstance(prompt, str):
+            raise ValueError("BatchedOpenAIClient only supports text prompts")
+
+        loop = asyncio.get_running_loop()
+        with self._pending_lock:
+            pending = self._pending.get(loop)
+            if pending is None:
+                pending = self._pending[loop] = _PendingBatch()
+
+        future = loop.create_future()
+        pending.items.append((prompt, future))
+        if len(pending.items) >= self.max_batch_size:
+            self._flush(loop, pending)
+        elif pending.timer is None:
+            pending.timer = loop.call_later(
+                self.batch_wait_timeout_s, self._flush, loop, pending
+            )
+        return await future
+
+    def _flush(self, loop: asyncio.AbstractEventLoop, pending: _PendingBatch):
+        """在所属事件循环中发送该循环当前凑到的批次"""
+        if pending.timer is not None:
+            pending.timer.cancel()
+            pending.timer = None
+
+        batch, pending.items = pending.items, []
+        if not batch:
+            return
+        task = loop.create_task(self._send(batch))
+        pending.tasks.add(task)
+        task.add_done_callback(pending.tasks.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]):
+        """
+        发送一次批量请求，将结果按顺序分发给各个调用方
+
+        Args:
+            batch: (prompt, future)列表
+        """
+        try:
+            response = await self.async_client.completions.create(
+                model=self.model,
+                prompt=[prompt for prompt, _ in batch],
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+            )
+            texts = [""] * len(batch)
+            for choice in response.choices:
+                texts[choice.index] = choice.text
+            logger.debug(f"Completed batched LLM request, batch size: {len(batch)}")
+        except Exception as e:
+            logger.error(f"Error in batched LLM request: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), text in zip(batch, texts):
+            if not future.done():
+                future.set_result(text)
@@ -1,12 +1,74 @@
+import asyncio
+import functools
+import itertools
 import logging
+import random
+import secrets
 import time
-from typing import Generator, Optional, Dict, Any, List, Union
+from typing import Generator, AsyncGenerator, Optional, Dict, Any, List, Union
 
 from kag.common.llm import OpenAIClient
 from kag.interface import LLMClient
+from openai import (
+    APIConnectionError,
+    AsyncAzureOpenAI,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
 
 logger = logging.getLogger()
 
+# 可以重试的错误：连接失败(含超时)、限流和服务端错误，其余错误(如400)重试无意义
+RETRYABLE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+# 请求ID：进程内随机前缀加递增序号，并发请求不会重复
+_REQ_PREFIX = secrets.token_hex(3)
+_REQ_COUNTER = itertools.count()
+# 重试等待时间上限(秒)
+MAX_RETRY_DELAY = 30.0
+# smooth_stream：超过该长度的文本块拆成SMOOTH_STREAM_PIECE_SIZE个字符一块，每块间隔SMOOTH_STREAM_INTERVAL秒
+SMOOTH_STREAM_THRESHOLD = 50
+SMOOTH_STREAM_PIECE_SIZE = 4
+SMOOTH_STREAM_INTERVAL = 0.02
+
+
+@functools.lru_cache(maxsize=8)
+def _token_encoding(model: str):
+    """获取模型对应的tiktoken编码，首次使用时才加载tiktoken"""
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _count_tokens(model: str, text: str) -> int:
+    """按模型的编码统计文本的token数，中文等非ASCII文本不能按字符数估算"""
+    return len(_token_encoding(model).encode(text))
+
+
+def _log_completion_tokens(request_id: str, model: str, parts: List[str]):
+    """
+    在debug日志中记录输出的token数
+
+    响应此时已经全部输出，统计失败(如离线时无法下载tiktoken编码)只记录日志，
+    不能当作LLM调用失败触发重试或追加错误信息
+    """
+    try:
+        total_tokens = _count_tokens(model, "".join(parts))
+    except Exception as e:
+        logger.debug("[%s] Failed to count completion tokens: %s", request_id, e)
+        return
+    logger.debug(
+        "[%s] Completed LLM request, total tokens: %d", request_id, total_tokens
+    )
+
+
+def _next_request_id() -> str:
+    """生成用于日志关联的请求ID"""
+    return f"req_{_REQ_PREFIX}_{next(_REQ_COUNTER)}"
+
 
 @LLMClient.register("stream_openai_llm")
 class StreamOpenAIClient(OpenAIClient):
@@ -25,6 +87,7 @@ class StreamOpenAIClient(OpenAIClient):
         max_retries: int = 3,
         retry_interval: int = 2,
         system_prompt: str = "you are a helpful assistant",
+        smooth_stream: bool = False,
     ):
         """
         初始化流式OpenAI客户端
@@ -37,8 +100,9 @@ class StreamOpenAIClient(OpenAIClient):
             api_version: API版本，用于Azure等服务
             timeout: 请求超时时间(秒)
             max_retries: 最大重试次数
-            retry_interval: 重试间隔(秒)
+            retry_interval: 重试基础间隔(秒)，按指数退避递增
             system_prompt: 系统提示词
+            smooth_stream: 是否将上游一次返回的大段文本拆成小块，通过reporter匀速汇报
         """
         super().__init__(
             api_key=api_key,
@@ -52,7 +116,10 @@ class StreamOpenAIClient(OpenAIClient):
         self.max_retries = max_retries
         self.retry_interval = retry_interval
         self.system_prompt = system_prompt
+        # 系统消息在所有请求间共用
+        self._system_message = {"role": "system", "content": system_prompt}
         self.api_version = api_version
+        self.smooth_stream = smooth_stream
 
         # 如果使用Azure，修改URL格式
         if api_version:
@@ -62,10 +129,75 @@ class StreamOpenAIClient(OpenAIClient):
         else:
             self.is_azure = False
 
+        # 异步客户端，供异步求解流程使用，等待LLM响应时不占用工作线程
+        if self.is_azure:
+            self.async_client = AsyncAzureOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                api_version=api_version,
+                timeout=timeout,
+            )
+        else:
+            self.async_client = AsyncOpenAI(
+                api_key=api_key, base_url=base_url, timeout=timeout
+            )
+
         logger.info(
             f"Initialized StreamOpenAIClient with model: {model}, base_url: {base_url}"
         )
 
+    def _retry_delay(self, attempt: int, error: Exception) -> Optional[float]:
+        """
+        计算下一次重试前的等待时间，指数退避并加入随机抖动
+
+        Args:
+            attempt: 当前尝试次数(从0开始)
+            error: 本次请求的异常
+
+        Returns:
+            等待时间(秒)，不应重试时返回None
+        """
+        if attempt >= self.max_retries - 1 or not isinstance(error, RETRYABLE_ERRORS):
+            return None
+
+        # 服务端通过Retry-After指定了等待时间时以其为准
+        response = getattr(error, "response", None)
+        retry_after = (
+            response.headers.get("retry-after") if response is not None else None
+        )
+        if retry_after:
+            try:
+                return min(max(float(retry_after), 0.0), MAX_RETRY_DELAY)
+            except ValueError:
+                pass
+
+        delay = min(self.retry_interval * (2**attempt), MAX_RETRY_DELAY)
+        return delay + random.uniform(0, delay * 0.25)
+
+    def _build_messages(
+        self, prompt: str, image_url: str = None
+    ) -> List[Dict[str, Any]]:
+        """
+        构造请求消息
+
+        Args:
+            prompt: 用户输入文本
+            image_url: 图片URL (如果支持多模态)
+
+        Returns:
+            消息列表
+        """
+        # 添加图片内容（如果提供）
+        if image_url:
+            logger.info(f"Adding image URL to message: {image_url}")
+            user_content = [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": image_url}},
+            ]
+        else:
+            user_content = prompt
+        return [self._system_message, {"role": "user", "content": user_content}]
+
     def __call__(
         self, prompt: str = "", image_url: str = None, **kwargs
     ) -> Generator[str, None, None]:
@@ -80,24 +212,12 @@ class StreamOpenAIClient(OpenAIClient):
         Returns:
             生成器，产生模型输出的文本块
         """
-        message = [
-            {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": prompt},
-        ]
-
-        # 添加图片内容（如果提供）
-        if image_url:
-            logger.info(f"Adding image URL to message: {image_url}")
-            if isinstance(message[-1]["content"], str):
-                message[-1]["content"] = [
-                    {"type": "text", "text": message[-1]["content"]},
-                    {"type": "image_url", "image_url": {"url": image_url}},
-                ]
+        message = self._build_messages(prompt, image_url)
 
         # 记录请求开始
-        request_id = f"req_{int(time.time())}"
+        request_id = _next_request_id()
         logger.debug(
-            f"[{request_id}] Starting LLM request with prompt: {prompt[:100]}..."
+            "[%s] Starting LLM request with prompt: %.100s...", request_id, prompt
         )
 
         for attempt in range(self.max_retries):
@@ -119,30 +239,203 @@ class StreamOpenAIClient(OpenAIClient):
                 response = self.client.chat.completions.create(**request_params)
 
                 # 处理流式响应
-                response_text = ""
+                # 只在开启debug日志时保留输出，用于统计token数
+                parts = [] if logger.isEnabledFor(logging.DEBUG) else None
                 for chunk in response:
                     # 抽取文本内容
                     content = chunk.choices[0].delta.content
                     if content:
-                        response_text += content
+                        if parts is not None:
+                            parts.append(content)
                         yield content
 
-                logger.debug(
-                    f"[{request_id}] Completed LLM request, total tokens: ~{len(response_text) // 4}"
-                )
+                if parts is not None:
+                    _log_completion_tokens(request_id, self.model, parts)
                 return
 
             except Exception as e:
                 logger.error(
-                    f"Error in LLM request (attempt {attempt+1}/{self.max_retries}): {str(e)}"
+                    "[%s] Error in LLM request (attempt %d/%d): %s",
+                    request_id,
+                    attempt + 1,
+                    self.max_retries,
+                    e,
                 )
-                if attempt < self.max_retries - 1:
-                    logger.info(f"Retrying in {self.retry_interval} seconds...")
-                    time.sleep(self.retry_interval)
+                delay = self._retry_delay(attempt, e)
+                if delay is not None:
+                    logger.info("[%s] Retrying in %.2f seconds...", request_id, delay)
+                    time.sleep(delay)
                 else:
-                    logger.error(f"Max retries exceeded for LLM request")
+                    logger.error("[%s] Giving up LLM request", request_id)
                     # 返回错误信息
                     error_message = f"Error calling language model: {str(e)}"
                     yield error_message
                     return
-        pass
+
+    async def astream(
+        self,
+        prompt: str = "",
+        image_url: str = None,
+        messages: Optional[List[Dict[str, Any]]] = None,
+        **kwargs,
+    ) -> AsyncGenerator[str, None]:
+        """
+        异步调用LLM模型，处理流式响应
+
+        Args:
+            prompt: 用户输入文本
+            image_url: 图片URL (如果支持多模态)
+            messages: 完整的消息列表，提供时忽略prompt和image_url
+            **kwargs: 其他参数
+
+        Returns:
+            异步生成器，产生模型输出的文本块
+        """
+        message = messages or self._build_messages(prompt, image_url)
+
+        # 记录请求开始
+        request_id = _next_request_id()
+        logger.debug(
+            "[%s] Starting async LLM request with prompt: %.100s...", request_id, prompt
+        )
+
+        for attempt in range(self.max_retries):
+            try:
+                # 发送请求，Azure的API版本由客户端统一添加
+                response = await self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=message,
+                    stream=self.stream,
+                    temperature=self.temperature,
+                    timeout=self.timeout,
+                )
+
+                # 处理流式响应
+                # 只在开启debug日志时保留输出，用于统计token数
+                parts = [] if logger.isEnabledFor(logging.DEBUG) else None
+                async for chunk in response:
+                    if not chunk.choices:
+                        continue
+                    # 抽取文本内容
+                    content = chunk.choices[0].delta.content
+                    if not content:
+                        continue
+                    if parts is not None:
+                        parts.append(content)
+                    yield content
+
+                if parts is not None:
+                    _log_completion_tokens(request_id, self.model, parts)
+                return
+
+            except Exception as e:
+                logger.error(
+                    "[%s] Error in async LLM request (attempt %d/%d): %s",
+                    request_id,
+                    attempt + 1,
+                    self.max_retries,
+                    e,
+                )
+                delay = self._retry_delay(attempt, e)
+                if delay is not None:
+                    logger.info("[%s] Retrying in %.2f seconds...", request_id, delay)
+                    await asyncio.sleep(delay)
+                else:
+                    logger.error("[%s] Giving up async LLM request", request_id)
+                    # 返回错误信息
+                    yield f"Error calling language model: {str(e)}"
+                    return
+
+    async def _acreate_message(
+        self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]]
+    ):
+        """
+        以非流式请求调用带工具的LLM，流式响应中的tool_calls分散在各个分片里，不便于拼接
+
+        Args:
+            messages: 消息列表
+            tools: 工具定义列表
+
+        Returns:
+            模型返回的消息对象
+        """
+        request_id = _next_request_id()
+        for attempt in range(self.max_retries):
+            try:
+                response = await self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    stream=False,
+                    temperature=self.temperature,
+                    timeout=self.timeout,
+                    tools=tools,
+                )
+                return response.choices[0].message
+            except Exception as e:
+                logger.error(
+                    "[%s] Error in async LLM tool request (attempt %d/%d): %s",
+                    request_id,
+                    attempt + 1,
+                    self.max_retries,
+                    e,
+                )
+                delay = self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                logger.info("[%s] Retrying in %.2f seconds...", request_id, delay)
+                await asyncio.sleep(delay)
+
+    async def acall(self, prompt: str = "", image_url: str = None, **kwargs):
+        """
+        异步调用LLM模型，返回完整的响应文本
+
+        与OpenAIClient.acall一致：通过reporter汇报中间结果，
+        传入messages时直接使用，传入tools且模型调用了工具时返回消息对象
+
+        Args:
+            prompt: 用户输入文本
+            image_url: 图片URL (如果支持多模态)
+            **kwargs: 其他参数，支持reporter、segment_name、tag_name、tools和messages
+
+        Returns:
+            模型输出的完整文本，模型调用了工具时返回消息对象
+        """
+        reporter = kwargs.get("reporter")
+        segment_name = kwargs.get("segment_name")
+        tag_name = kwargs.get("tag_name")
+        tools = kwargs.get("tools")
+        messages = kwargs.get("messages")
+        if reporter:
+            reporter.add_report_line(segment_name, tag_name, "", status="INIT")
+
+        if tools:
+            message = await self._acreate_message(
+                messages or self._build_messages(prompt, image_url), tools
+            )
+            rsp = message.content or ""
+            if reporter:
+                reporter.add_report_line(segment_name, tag_name, rsp, status="FINISH")
+            return message if message.tool_calls else rsp
+
+        rsp = ""
+        async for content in self.astream(prompt, image_url, messages=messages):
+            if (
+                reporter
+                and self.smooth_stream
+                and len(content) > SMOOTH_STREAM_THRESHOLD
+            ):
+                # 部分网关会缓冲后一次返回大段文本，拆成小块匀速汇报给客户端；
+                # 没有reporter时中间结果无人可见，不必等待
+                for i in range(0, len(content), SMOOTH_STREAM_PIECE_SIZE):
+                    rsp += content[i : i + SMOOTH_STREAM_PIECE_SIZE]
+                    reporter.add_report_line(
+                        segment_name, tag_name, rsp, status="RUNNING"
+                    )
+                    await asyncio.sleep(SMOOTH_STREAM_INTERVAL)
+                continue
+            rsp += content
+            if reporter:
+                reporter.add_report_line(segment_name, tag_name, rsp, status="RUNNING")
+        if reporter:
+            reporter.add_report_line(segment_name, tag_name, rsp, status="FINISH")
+        return rsp
@@ -1,16 +1,16 @@
 import asyncio
 import concurrent.futures
-import json
+import hashlib
 import logging
 import multiprocessing
 import os.path
 import threading
-import traceback
-from abc import ABC
+import time
 from multiprocessing import Process
-from typing import Generator, AsyncGenerator, Optional, Any, Union
+from typing import AsyncGenerator, Optional, Any, Union, Callable, Dict, List, Tuple
+
+import orjson
 
-from jedi.inference.gradual.typing import Callable
 from kag.common.conf import KAGConstants, KAG_CONFIG, KAG_PROJECT_CONF
 from kag.common.registry import import_modules_from_path
 from kag.interface import SolverPipelineABC
@@ -27,73 +27,68 @@ from app.utils import remove_empty_fields
 logger = logging.getLogger()
 
 
-class EventQueue(Generator, ABC):
+# EventQueue关闭标记
+_QUEUE_CLOSED = object()
+
+
+class EventQueue:
     """
-    A queue that can be used to send events to a generator.
-    Stop iteration while got a 'None' event
+    An asyncio.Queue based event queue, consumed with 'async for'.
+    Stop iteration while got a 'None' event or the queue is closed.
+    Events can be sent from any thread, they are handed over to the owner loop.
     """
 
-    def __init__(self):
-        self.events = []
-        self.lock = threading.Lock()
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop or asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
         self.closed = False
-        self.event_available = threading.Event()
-
-    def __next__(self):
-        if self.closed and len(self.events) == 0:
-            raise StopIteration
-
-        # 等待事件可用或队列关闭
-        while len(self.events) == 0 and not self.closed:
-            # 设置超时防止无限等待
-            self.event_available.wait(timeout=0.1)
-
-        with self.lock:
-            if len(self.events) == 0:
-                if self.closed:
-                    raise StopIteration
-                return None
-
-            event = self.events.pop(0)
 
+    def _put(self, item: Any):
+        """在队列所属的事件循环中放入元素，其他线程调用时转交给该循环"""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self.queue.put_nowait(item)
+        else:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+    def send(self, event: Any):
+        if self.closed:
+            logger.warning("Attempting to send event to closed queue")
+            return
         if event is None:
             self.close()
-            raise StopIteration
-        return event
-
-    def send(self, event: any):
-        with self.lock:
-            if self.closed:
-                logger.warning("Attempting to send event to closed queue")
-                return
-
-            self.events.append(event)
-            self.event_available.set()  # 通知有新事件
-
-        # 重置事件，以便下次等待
-        if event is not None:
-            self.event_available.clear()
+            return
+        self._put(event)
 
     def close(self):
         """关闭队列，不再接受新事件"""
-        with self.lock:
-            self.closed = True
-            self.event_available.set()  # 确保等待的线程能继续
-
-    def throw(self, typ, val=None, tb=None):
-        """处理异常，清理资源"""
-        logger.error(f"Exception in event queue: {typ} {val}")
-        self.close()
-        pass
+        if self.closed:
+            return
+        self.closed = True
+        self._put(_QUEUE_CLOSED)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.queue.get()
+        if event is _QUEUE_CLOSED:
+            # 保留关闭标记，重复迭代时同样结束
+            self.queue.put_nowait(event)
+            raise StopAsyncIteration
+        return event
 
 
 class EventReporter(OpenSPGReporter):
     """事件报告器，将OpenSPG的报告转换为事件流"""
 
-    def __init__(self, callback=None, **kwargs):
+    def __init__(self, callback=None, queue: Optional[EventQueue] = None, **kwargs):
         super().__init__(0, **kwargs)
         self.callback = callback
-        self.events = []
+        self.queue = queue
 
     def add_report_line(self, segment, tag_name, content, status, **kwargs):
         super().add_report_line(segment, tag_name, content, status, **kwargs)
@@ -103,8 +98,9 @@ class EventReporter(OpenSPGReporter):
         # 创建安全的事件数据
         safe_data = remove_empty_fields({"event": "changed", "data": report_data})
 
-        # 存储事件
-        self.events.append(safe_data)
+        # 推送事件，查询方在求解过程中即可消费
+        if self.queue is not None:
+            self.queue.send(safe_data)
 
         # 如果有回调，则调用
         if self.callback:
@@ -114,6 +110,150 @@ class EventReporter(OpenSPGReporter):
                 logger.error(f"Error in report_line callback: {str(e)}")
 
 
+class _Broadcast:
+    """
+    将一次查询的结果广播给所有订阅者
+    晚到的订阅者先重放已产生的结果，再继续接收后续结果；
+    查询出错或被取消时所有订阅者都收到异常，所有订阅者都离开后取消查询
+
+    changed事件的内容是按tag_name累计的全文，重放缓冲中每个tag_name只保留最新的一个事件
+    """
+
+    _EOF = object()
+
+    def __init__(self, source: AsyncGenerator[Any, None], on_done: Callable[[], None]):
+        self.buffer: List[Any] = []
+        # tag_name到其最新changed事件在buffer中位置的映射
+        self._changed_index: Dict[Any, int] = {}
+        self.subscribers: List[asyncio.Queue] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.on_done = on_done
+        self.task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncGenerator[Any, None]):
+        try:
+            async for chunk in source:
+                self._buffer_chunk(chunk)
+                for queue in self.subscribers:
+                    queue.put_nowait(chunk)
+        except asyncio.CancelledError:
+            # 查询被取消时结果不完整，尚未读完的订阅者不能当作正常结束
+            self.error = RuntimeError("coalesced query cancelled")
+            raise
+        except Exception as e:
+            logger.exception("Error in coalesced query: %s", e)
+            self.error = e
+        finally:
+            self.done = True
+            self.on_done()
+            for queue in self.subscribers:
+                queue.put_nowait(self._EOF)
+
+    def _buffer_chunk(self, chunk: Any):
+        """
+        将分片放入重放缓冲，同一tag_name的changed事件用最新的替换之前的
+        """
+        data = chunk.get("data") if type(chunk) is dict else None
+        if type(data) is dict and chunk.get("event") == "changed":
+            tag_name = data.get("tag_name")
+            index = self._changed_index.get(tag_name)
+            if index is not None:
+                self.buffer[index] = chunk
+                return
+            self._changed_index[tag_name] = len(self.buffer)
+        self.buffer.append(chunk)
+
+    async def subscribe(self) -> AsyncGenerator[Any, None]:
+        queue = asyncio.Queue()
+        for chunk in self.buffer:
+            queue.put_nowait(chunk)
+        if self.done:
+            queue.put_nowait(self._EOF)
+        else:
+            self.subscribers.append(queue)
+
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is self._EOF:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                yield chunk
+        finally:
+            if queue in self.subscribers:
+                self.subscribers.remove(queue)
+                if not self.subscribers and not self.done:
+                    # 没有订阅者了，不再接纳新的订阅者并取消查询，
+                    # 查询中的求解任务随之取消并释放配置闸门
+                    self.on_done()
+                    self.task.cancel()
+
+
+class _ConfigGate:
+    """
+    KAG_CONFIG和KAG_PROJECT_CONF是进程级的全局配置，求解过程中仍会被读取。
+    同一项目的查询可以并发执行，切换到其他项目前等待当前项目的查询全部结束，
+    有其他项目在等待时不再接纳当前项目的新查询，避免等待方饿死。
+    release是同步方法，可以在求解任务的done回调中调用
+    """
+
+    def __init__(self):
+        self._waiters: List[asyncio.Future] = []
+        self._project_id: Optional[str] = None
+        self._active = 0
+        self._switching = 0
+
+    def _can_enter(self, project_id: str) -> bool:
+        if self._active == 0:
+            return True
+        return self._project_id == project_id and self._switching == 0
+
+    def _wake_all(self):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def acquire(self, project_id: str, config: Dict[str, Any]):
+        """
+        将全局配置切换为指定项目，之后必须调用一次release
+
+        Args:
+            project_id: 项目ID
+            config: 项目的KAG配置
+        """
+        key = str(project_id)
+        switching = self._active > 0 and self._project_id != key
+        if switching:
+            self._switching += 1
+        try:
+            while not self._can_enter(key):
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+                try:
+                    await waiter
+                finally:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+        finally:
+            if switching:
+                self._switching -= 1
+                # 等待切换的项目减少后，当前项目被拦下的查询可能可以进入了
+                self._wake_all()
+        if self._active == 0:
+            KAG_CONFIG.update_conf(config)
+            KAG_PROJECT_CONF.project_id = project_id
+            self._project_id = key
+        self._active += 1
+
+    def release(self):
+        """结束一次acquire"""
+        self._active -= 1
+        self._wake_all()
+
+
 def load_kag_config(host_addr, project_id):
     """
     copy those codes from kag.common.conf.load_config
@@ -122,7 +262,7 @@ def load_kag_config(host_addr, project_id):
     project = project_client.get_by_id(project_id)
     if not project:
         return {}
-    config = json.loads(project.config)
+    config = orjson.loads(project.config)
     if "project" not in config:
         config["project"] = {
             KAGConstants.KAG_PROJECT_ID_KEY: project_id,
@@ -140,7 +280,12 @@ def load_kag_config(host_addr, project_id):
 
 class KagService:
 
-    def __init__(self, service_url: str, addition_modules: list[str] = None):
+    def __init__(
+        self,
+        service_url: str,
+        addition_modules: list[str] = None,
+        config_ttl: float = 60.0,
+    ):
         self.service_url = service_url
 
         import_modules_from_path(
@@ -150,16 +295,86 @@ class KagService:
             import_modules_from_path(module)
 
         self.project_client = ProjectClient(host_addr=self.service_url, project_id=-1)
-        logger.info("loading projects")
-        self.project_list = self.project_client.get_all()
-        logger.info(f"loaded {len(self.project_list)} projects")
+        self.project_list: Dict[str, Any] = {}
+        # 项目名称及字符串形式的项目ID到项目ID的映射
+        self._by_key: Dict[str, Any] = {}
+        # /models接口的响应体，项目列表变化时失效
+        self._models_payload: Optional[bytes] = None
+        self.refresh_projects()
+
+        # 正在执行的查询，相同的(query, project_id)并发请求共用一次求解
+        self._inflight: Dict[str, _Broadcast] = {}
+
+        # 项目ID到(加载时间, 序列化的KAG配置)的缓存，每个项目一把锁，并发的冷启动请求只加载一次
+        self.config_ttl = config_ttl
+        self._config_cache: Dict[str, Tuple[float, bytes]] = {}
+        self._config_locks: Dict[str, asyncio.Lock] = {}
+        # 全局KAG配置只能通过该闸门修改
+        self._config_gate = _ConfigGate()
+
+    def refresh_projects(self):
+        """重新加载项目列表，项目列表变化时使/models响应缓存失效"""
+        logger.debug("loading projects")
+        project_list = self.project_client.get_all()
+        for project_name, project_key in project_list.items():
+            logger.debug(f"  - {project_name}: {project_key}")
+        # 后台定期刷新，项目列表没有变化时保留已有的映射和/models缓存，也不输出INFO日志
+        if project_list == self.project_list and self._by_key:
+            return
+        logger.info(f"loaded {len(project_list)} projects")
+        self.project_list = project_list
+        by_key = {}
         for project_name, project_key in self.project_list.items():
-            logger.info(f"  - {project_name}: {project_key}")
-        pass
+            by_key[project_name] = project_key
+            by_key[str(project_key)] = project_key
+        self._by_key = by_key
+        self._models_created = int(time.time())
+        self._models_payload = None
+
+    async def auto_refresh_projects(self, interval: float = 300.0):
+        """
+        后台定期刷新项目列表，请求处理过程中不再同步拉取项目列表
+
+        Args:
+            interval: 刷新间隔(秒)
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.refresh_projects)
+            except Exception as e:
+                logger.warning(f"Failed to refresh projects: {e}")
 
     def get_projects(self):
         return self.project_list
 
+    def get_models_payload(self) -> bytes:
+        """
+        获取OpenAI兼容的/models响应体，按项目列表预先序列化
+
+        Returns:
+            bytes: JSON编码的模型列表
+        """
+        payload = self._models_payload
+        if payload is None:
+            created = self._models_created
+            payload = orjson.dumps(
+                {
+                    "object": "list",
+                    "data": [
+                        {
+                            "id": f"openspg/{name}",
+                            "object": "model",
+                            "created": created,
+                            "owned_by": "openspg",
+                        }
+                        for name in self.project_list.keys()
+                    ],
+                }
+            )
+            self._models_payload = payload
+        return payload
+
     def get_project_id_by_name(self, project_name: str):
         return self.project_list.get(project_name)
 
@@ -167,6 +382,83 @@ class KagService:
         """加载KAG配置"""
         return load_kag_config(service_url, project_id)
 
+    async def get_kag_config(self, project_id: str) -> Dict[str, Any]:
+        """
+        获取项目的KAG配置，结果按项目缓存config_ttl秒
+
+        Args:
+            project_id: 项目ID
+
+        Returns:
+            Dict[str, Any]: KAG配置的副本，项目不存在时返回空字典
+        """
+        key = str(project_id)
+        cached = self._config_cache.get(key)
+        if not cached or time.monotonic() - cached[0] >= self.config_ttl:
+            lock = self._config_locks.setdefault(key, asyncio.Lock())
+            try:
+                async with lock:
+                    # 等待锁期间其他请求可能已经加载完成
+                    cached = self._config_cache.get(key)
+                    if not cached or time.monotonic() - cached[0] >= self.config_ttl:
+                        # ProjectClient是同步HTTP客户端，放到线程中执行避免阻塞事件循环
+                        config = await asyncio.to_thread(
+                            load_kag_config, self.service_url, project_id
+                        )
+                        if not config:
+                            return {}
+                        cached = (time.monotonic(), orjson.dumps(config))
+                        self._config_cache[key] = cached
+            finally:
+                # 加载失败(如项目不存在)时不保留锁，避免任意项目ID让_config_locks无限增长
+                if (
+                    key not in self._config_cache
+                    and self._config_locks.get(key) is lock
+                ):
+                    del self._config_locks[key]
+        # 构建求解器时可能修改配置，每次解析出新的副本，orjson解析比deepcopy快
+        return orjson.loads(cached[1])
+
+    def invalidate_config(self, project_id: Optional[str] = None):
+        """
+        使KAG配置缓存失效
+
+        Args:
+            project_id: 项目ID，为空时清空所有项目的缓存
+        """
+        if project_id is None:
+            self._config_cache.clear()
+        else:
+            self._config_cache.pop(str(project_id), None)
+
+    def coalesced_query(self, query: str, project_id: str) -> AsyncGenerator[Any, None]:
+        """
+        查询知识图谱，相同的并发查询只执行一次，结果广播给所有请求方
+
+        Args:
+            query: 用户查询文本
+            project_id: 项目ID
+
+        Returns:
+            异步生成器，产生查询结果
+        """
+        key = hashlib.sha1(f"{query}|{project_id}".encode("utf-8")).hexdigest()
+        broadcast = self._inflight.get(key)
+        if broadcast is None:
+
+            def evict():
+                # 取消和结束都会调用，只移除自己，不影响之后的同名查询
+                if self._inflight.get(key) is broadcast:
+                    del self._inflight[key]
+
+            broadcast = _Broadcast(self.query(query, project_id), on_done=evict)
+            self._inflight[key] = broadcast
+        else:
+            logger.info(
+                f"Coalescing query into in-flight request, project: {project_id}"
+            )
+        return broadcast.subscribe()
+
     async def query(
         self, query: str, project_id: str, printer=None
     ) -> AsyncGenerator[Any, None]:
@@ -182,19 +474,14 @@ class KagService:
             异步生成器，产生查询结果
         """
         try:
-            # 创建事件报告器，将结果保存到事件列表
-            reporter = EventReporter(callback=printer)
-
-            # 检查项目ID是否有效,如果不是数字ID尝试获取对应的项目ID
-            if not project_id.isdigit() and project_id in self.project_list:
-                numeric_id = self.project_list.get(project_id)
-                logger.info(f"Converting project name {project_id} to ID {numeric_id}")
-                project_id = numeric_id
+            # 创建事件报告器，报告事件实时推送到事件队列
+            events = EventQueue()
+            reporter = EventReporter(callback=printer, queue=events)
 
-            global_config = load_kag_config(self.service_url, project_id)
+            # 项目名称或项目ID统一转换为项目ID
+            project_id = self._by_key.get(project_id, project_id)
 
-            KAG_CONFIG.update_conf(global_config)
-            KAG_PROJECT_CONF.project_id = project_id
+            global_config = await self.get_kag_config(project_id)
 
             solver_config = global_config.get("solver_pipeline")
             if not solver_config:
@@ -216,15 +503,32 @@ class KagService:
                 return
 
             try:
-                # 创建求解器管道
-                solver = SolverPipelineABC.from_config(solver_config)
-
-                # 调用求解器，获取结果
-                result = await solver.ainvoke(query, reporter=reporter)
-
-                # 先返回所有报告事件
-                for event in reporter.events:
-                    yield event
+                # 切换全局配置，求解结束前其他项目的查询需要等待
+                await self._config_gate.acquire(project_id, global_config)
+                try:
+                    # 创建求解器管道
+                    solver = SolverPipelineABC.from_config(solver_config)
+
+                    # 在后台调用求解器，求解过程中产生的报告事件边产生边返回
+                    task = asyncio.create_task(solver.ainvoke(query, reporter=reporter))
+                except BaseException:
+                    self._config_gate.release()
+                    raise
+
+                def on_solver_done(_):
+                    # 求解结束即释放闸门，不等客户端读完剩余事件
+                    self._config_gate.release()
+                    events.close()
+
+                task.add_done_callback(on_solver_done)
+                try:
+                    async for event in events:
+                        yield event
+                    result = await task
+                finally:
+                    # 客户端断开时取消求解
+                    if not task.done():
+                        task.cancel()
 
                 # 然后返回最终结果
                 if result:
@@ -232,11 +536,7 @@ class KagService:
 
             except Exception as solver_error:
                 # 处理求解器错误，但返回友好响应
-                error_message = (
-                    f"Error initializing solver pipeline: {str(solver_error)}"
-                )
-                logger.error(error_message)
-                traceback.print_exc()
+                logger.exception("Error initializing solver pipeline: %s", solver_error)
 
                 response = "很抱歉，处理您的请求时遇到了问题。请稍后再试或联系管理员。"
                 mock_event = {
@@ -251,9 +551,7 @@ class KagService:
 
         except Exception as e:
             # 处理一般错误，但返回友好响应
-            error_message = f"Error in query execution: {str(e)}"
-            logger.error(error_message)
-            traceback.print_exc()
+            logger.exception("Error in query execution: %s", e)
 
             response = "很抱歉，处理您的请求时遇到了问题。请稍后再试或联系管理员。"
             mock_event = {
@@ -268,14 +566,23 @@ class KagService:
 
 
 kag_service = None
+_kag_service_lock = threading.Lock()
 
 
 def get_kag_service(service_url: str, addition_modules: list[str] = None) -> KagService:
+    """
+    获取进程内唯一的KagService实例
+
+    KAG的全局配置(KAG_CONFIG/KAG_PROJECT_CONF)由所有查询共享，
+    只能在KagService的配置闸门内修改，不要在其他地方直接修改
+    """
     global kag_service
     if kag_service is None:
-        kag_service = KagService(
-            service_url=service_url, addition_modules=addition_modules
-        )
+        with _kag_service_lock:
+            if kag_service is None:
+                kag_service = KagService(
+                    service_url=service_url, addition_modules=addition_modules
+                )
     return kag_service
 
 
@@ -1,9 +1,12 @@
+import asyncio
+from importlib.metadata import version
 from pathlib import Path
 import os
 import logging
 import json
 from typing import Dict, Any, List, Optional
 
+import jsonschema
 from fastapi import FastAPI, Depends, Body, HTTPException
 from fastapi.openapi.docs import get_swagger_ui_html
 from starlette.responses import JSONResponse, RedirectResponse, HTMLResponse
@@ -14,6 +17,34 @@ from app.openspg.service.kag_service import get_kag_service
 
 logger = logging.getLogger()
 
+# 安装的openspg-kag版本，查找包元数据需要读取磁盘，只在加载时查询一次
+try:
+    _KAG_VERSION = version("openspg-kag")
+except Exception:
+    _KAG_VERSION = "unknown"
+
+# 项目配置的结构校验，模块加载时编译一次
+_CONFIG_SCHEMA = {
+    "type": "object",
+    "required": ["solver_pipeline"],
+    "properties": {
+        "solver_pipeline": {
+            "type": "object",
+            "required": ["generator"],
+            "properties": {
+                "generator": {"type": "object", "required": ["llm_client"]},
+            },
+        },
+    },
+}
+_CONFIG_VALIDATOR = jsonschema.Draft202012Validator(_CONFIG_SCHEMA)
+# 缺失配置项对应的提示信息
+_MISSING_KEY_MESSAGES = {
+    "solver_pipeline": "Missing solver_pipeline configuration",
+    "solver_pipeline.generator": "Missing generator configuration in solver_pipeline",
+    "solver_pipeline.generator.llm_client": "Missing llm_client configuration in generator",
+}
+
 
 class ConfigValidationResponse(BaseModel):
     status: str
@@ -37,6 +68,28 @@ def mount_routes(app: FastAPI, args):
 
     api_prefix = f"{args.servlet}"
 
+    @app.on_event("startup")
+    async def init_kag_service():
+        """
+        启动时创建KAG服务实例，并在后台定期刷新项目列表
+        """
+        try:
+            service = await asyncio.to_thread(
+                get_kag_service, args.openspg_service, args.openspg_modules
+            )
+        except Exception as e:
+            logger.warning(f"Failed to initialize kag service: {e}")
+            return
+        app.state.project_refresh_task = asyncio.create_task(
+            service.auto_refresh_projects(args.project_refresh_interval)
+        )
+
+    @app.on_event("shutdown")
+    async def stop_project_refresh():
+        task = getattr(app.state, "project_refresh_task", None)
+        if task is not None:
+            task.cancel()
+
     # static files
     app.mount(f"{api_prefix}/static", StaticFiles(directory=Path("static").as_posix()))
 
@@ -79,15 +132,8 @@ def mount_routes(app: FastAPI, args):
         service = get_kag_service(args.openspg_service, args.openspg_modules)
         projects = service.get_projects()
 
-        from importlib.metadata import version
-
-        try:
-            kag_version = version("openspg-kag")
-        except:
-            kag_version = "unknown"
-
         return HealthResponse(
-            status="healthy", version=kag_version, projects=list(projects.keys())
+            status="healthy", version=_KAG_VERSION, projects=list(projects.keys())
         )
 
     @app.post(
@@ -107,31 +153,35 @@ def mount_routes(app: FastAPI, args):
             )
 
         try:
-            # 加载配置
+            # 加载配置，项目配置可能刚被修改，同时使查询使用的配置缓存失效
+            service.invalidate_config(project_id)
             config = service.load_kag_config(service.service_url, project_id)
 
-            # 检查solver_pipeline配置
-            if "solver_pipeline" not in config:
-                return ConfigValidationResponse(
-                    status="error",
-                    message="Missing solver_pipeline configuration",
-                    details={"missing_key": "solver_pipeline"},
-                )
-
-            # 检查generator配置
-            if "generator" not in config["solver_pipeline"]:
-                return ConfigValidationResponse(
-                    status="error",
-                    message="Missing generator configuration in solver_pipeline",
-                    details={"missing_key": "solver_pipeline.generator"},
-                )
-
-            # 检查llm_client配置
-            if "llm_client" not in config["solver_pipeline"]["generator"]:
+            # 检查solver_pipeline.generator.llm_client配置结构
+            errors = sorted(
+                _CONFIG_VALIDATOR.iter_errors(config), key=lambda e: len(e.path)
+            )
+            if errors:
+                error = errors[0]
+                path = [str(p) for p in error.path]
+                if error.validator == "required":
+                    missing = next(
+                        key
+                        for key in error.validator_value
+                        if key not in error.instance
+                    )
+                    missing_key = ".".join(path + [missing])
+                    return ConfigValidationResponse(
+                        status="error",
+                        message=_MISSING_KEY_MESSAGES.get(
+                            missing_key, f"Missing {missing_key} configuration"
+                        ),
+                        details={"missing_key": missing_key},
+                    )
                 return ConfigValidationResponse(
                     status="error",
-                    message="Missing llm_client configuration in generator",
-                    details={"missing_key": "solver_pipeline.generator.llm_client"},
+                    message=f"Invalid configuration: {error.message}",
+                    details={"path": ".".join(path)},
                 )
 
             # 获取LLM客户端配置
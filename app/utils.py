@@ -3,7 +3,66 @@ Toolkit
 """
 
 from enum import Enum
+import atexit
+import logging
+import logging.handlers
 import os
+import queue
+
+# 无需处理、直接返回的基本数据类型
+_SCALAR_TYPES = frozenset((str, int, float, bool, type(None)))
+# 清理后为空需要移除的容器类型
+_CONTAINER_TYPES = (dict, list)
+
+
+def _clean_dict(obj: dict) -> dict:
+    """移除字典中的空字段"""
+    scalar_types = _SCALAR_TYPES
+    result = {}
+    for key, value in obj.items():
+        if type(value) not in scalar_types:
+            value = remove_empty_fields(value)
+            if not value and type(value) in _CONTAINER_TYPES:
+                continue
+        if value is not None:
+            result[key] = value
+    return result
+
+
+def _clean_list(obj: list) -> list:
+    """移除列表中的空元素"""
+    scalar_types = _SCALAR_TYPES
+    result = []
+    for item in obj:
+        if type(item) not in scalar_types:
+            item = remove_empty_fields(item)
+            if not item and type(item) in _CONTAINER_TYPES:
+                continue
+        if item is not None:
+            result.append(item)
+    return result
+
+
+def _clean_object(obj):
+    """将复杂对象转换为可序列化的结构"""
+    try:
+        # 在类型上查找to_dict，避免实例属性的查找开销
+        if callable(getattr(type(obj), "to_dict", None)):
+            return remove_empty_fields(obj.to_dict())
+        elif hasattr(obj, "__dict__"):
+            return _clean_dict(
+                {k: v for k, v in obj.__dict__.items() if not k.startswith("_")}
+            )
+        else:
+            # 无法处理的对象转换为字符串
+            return str(obj)
+    except Exception:
+        # 完全无法处理的情况下，转换为字符串
+        return str(obj)
+
+
+# 按类型分派的处理函数
+_HANDLERS = {dict: _clean_dict, list: _clean_list}
 
 
 def remove_empty_fields(obj):
@@ -11,55 +70,25 @@ def remove_empty_fields(obj):
     递归地移除字典或列表中的空字段和None值
     同时处理不可序列化的对象，将其转换为字符串表示
     """
-    if obj is None:
-        return None
+    obj_type = type(obj)
+    # 基本数据类型直接返回
+    if obj_type in _SCALAR_TYPES:
+        return obj
+
+    handler = _HANDLERS.get(obj_type)
+    if handler is not None:
+        return handler(obj)
 
-    # 处理字典
+    # 处理字典、列表及基本数据类型的子类
     if isinstance(obj, dict):
-        result = {}
-        for key, value in obj.items():
-            processed_value = remove_empty_fields(value)
-            if (
-                processed_value is not None
-                and processed_value != {}
-                and processed_value != []
-            ):
-                result[key] = processed_value
-        return result
-
-    # 处理列表
+        return _clean_dict(obj)
     elif isinstance(obj, list):
-        result = []
-        for item in obj:
-            processed_item = remove_empty_fields(item)
-            if (
-                processed_item is not None
-                and processed_item != {}
-                and processed_item != []
-            ):
-                result.append(processed_item)
-        return result
-
-    # 基本数据类型直接返回
+        return _clean_list(obj)
     elif isinstance(obj, (str, int, float, bool)):
         return obj
 
     # 处理复杂对象
-    else:
-        try:
-            # 尝试将对象转换为字典
-            if hasattr(obj, "to_dict") and callable(getattr(obj, "to_dict")):
-                return remove_empty_fields(obj.to_dict())
-            elif hasattr(obj, "__dict__"):
-                return remove_empty_fields(
-                    {k: v for k, v in obj.__dict__.items() if not k.startswith("_")}
-                )
-            else:
-                # 无法处理的对象转换为字符串
-                return str(obj)
-        except Exception:
-            # 完全无法处理的情况下，转换为字符串
-            return str(obj)
+    return _clean_object(obj)
 
 
 def write_fake_config(filename: str, service_url: str, debug_level="INFO"):
@@ -97,3 +126,25 @@ def get_open_spg_address():
         str: OpenSPG服务地址
     """
     return os.environ.get("KAG_PROJECT_HOST_ADDR", "http://127.0.0.1:8887")
+
+
+def enable_queue_logging():
+    """
+    将根日志的处理器移到后台线程，业务代码只把日志记录放入队列，
+    写stderr等阻塞IO不会卡住事件循环
+    """
+    root = logging.getLogger()
+    if any(isinstance(h, logging.handlers.QueueHandler) for h in root.handlers):
+        return
+
+    handlers = root.handlers[:] or [logging.StreamHandler()]
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
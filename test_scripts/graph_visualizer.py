@@ -6,70 +6,269 @@
 """
 
 import argparse
+import asyncio
+import contextlib
+import gzip
+import hashlib
+import importlib.util
+import itertools
 import json
+import os
+import re
 import sys
-import requests
+import tempfile
+import time
+from dataclasses import dataclass
+import httpx
+import ijson
+import orjson
 import networkx as nx
+import matplotlib
+
+# 没有图形界面时使用Agg后端，避免初始化GTK/Tk
+if sys.platform.startswith("linux") and not (
+    os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")
+):
+    matplotlib.use("Agg")
 import matplotlib.pyplot as plt
-from typing import Dict, List, Any
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.patches import Patch
+from typing import Dict, List, Any, AsyncIterator, Optional
+
+# 节点类型的配色，按类型依次循环使用
+_TYPE_PALETTE = np.asarray(plt.cm.tab10.colors)
+# 超过该节点数不再绘制节点标签
+MAX_LABELED_NODES = 100
+# 超过该节点数不再使用Kamada-Kawai布局
+KAMADA_KAWAI_MAX_NODES = 500
+# 每次批量DSL查询包含的实体数
+BULK_RELATIONS_BATCH_SIZE = 50
+# 可以直接放入DSL双引号字符串的实体ID
+_BULK_ID_PATTERN = re.compile(r'^[^"\\\r\n]+$')
+# 实体关系的磁盘缓存目录及有效期(秒)
+RELATIONS_CACHE_DIR = os.path.expanduser("~/.cache/kg_viz")
+RELATIONS_CACHE_TTL = 3600
+# 使用datashader渲染时，超过该节点数才启用，以及输出图片的像素尺寸
+DATASHADER_MIN_NODES = 5000
+DATASHADER_WIDTH = 1920
+DATASHADER_HEIGHT = 1080
+# 请求遇到这些状态码或连接中断时按指数退避重试
+# 只重试幂等请求，其他请求需通过extensions={"retry": True}显式声明可以重试
+RETRY_STATUS_CODES = frozenset({502, 503, 504})
+RETRY_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+MAX_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.3
+
+
+@dataclass
+class _GraphArrays:
+    """图节点数据的列式存储，各数组均按G.nodes的顺序排列"""
+
+    ids: np.ndarray
+    names: np.ndarray
+    types: np.ndarray
+    # (n, 2)的布局坐标
+    positions: np.ndarray
+
+
+def _edge_array(G) -> np.ndarray:
+    """
+    图中所有边的两端节点，形状为(m, 2)
+
+    节点是按加入顺序编号的整数，编号即_GraphArrays中的行号，可以直接索引坐标数组
+    """
+    return np.fromiter(
+        itertools.chain.from_iterable(G.edges()),
+        dtype=np.intp,
+        count=2 * G.number_of_edges(),
+    ).reshape(-1, 2)
+
+
+class _RetryTransport(httpx.AsyncHTTPTransport):
+    """对网关错误和连接中断按指数退避重试的传输层，流式请求在读取响应体前重试"""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method not in RETRY_METHODS and not request.extensions.get("retry"):
+            return await super().handle_async_request(request)
+
+        for attempt in range(MAX_RETRIES + 1):
+            last_attempt = attempt == MAX_RETRIES
+            try:
+                response = await super().handle_async_request(request)
+            except (httpx.NetworkError, httpx.RemoteProtocolError):
+                if last_attempt:
+                    raise
+            else:
+                if last_attempt or response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(RETRY_BACKOFF_FACTOR * 2**attempt)
+
+
+class _AsyncByteReader:
+    """把httpx的异步字节流包装成ijson需要的async read接口"""
+
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks
+
+    async def read(self, size: int = -1) -> bytes:
+        # ijson会先用read(0)探测返回类型
+        if size == 0:
+            return b""
+        # 空字节串表示读到末尾，跳过流中的空块
+        async for chunk in self._chunks:
+            if chunk:
+                return chunk
+        return b""
 
 
 class GraphVisualizer:
     """知识图谱可视化工具"""
 
-    def __init__(self, base_url: str):
+    def __init__(
+        self,
+        base_url: str,
+        max_connections: int = 128,
+        dpi: int = 100,
+        cache_dir: Optional[str] = RELATIONS_CACHE_DIR,
+        renderer: str = "matplotlib",
+        show: bool = True,
+    ):
         """
         初始化可视化工具
 
         Args:
             base_url: API服务基础URL，如 http://localhost:8000/api/v1/graph
+            max_connections: 最大并发连接数
+            dpi: 保存图片的分辨率
+            cache_dir: 实体关系的磁盘缓存目录，为None时不使用缓存
+            renderer: 绘图方式，matplotlib或datashader，datashader只用于大图
+            show: 保存图片后是否打开窗口显示
         """
         self.base_url = base_url
-        self.session = requests.Session()
+        self.dpi = dpi
+        self.cache_dir = cache_dir
+        self.renderer = renderer
+        self.show = show
+        # 多次绘制复用同一个Figure
+        self._figure = None
+        # 批量查询返回空结果而逐个查询有关系时，说明服务端不支持批量查询，本次运行不再使用
+        self._bulk_relations = True
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        # 单个事件循环上复用keep-alive连接并发请求，超出连接数的请求在连接池中排队，
+        # 因此不设置等待连接的超时；安装了h2时HTTPS连接可协商HTTP/2多路复用
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(None),
+            transport=_RetryTransport(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                ),
+                http2=importlib.util.find_spec("h2") is not None,
+            ),
+        )
+
+    async def aclose(self):
+        """关闭HTTP连接池"""
+        await self.client.aclose()
+
+    @staticmethod
+    def _json(response: httpx.Response) -> Any:
+        """用orjson解析响应体，结果与response.json()一致"""
+        return orjson.loads(response.content)
 
-    def get_available_graphs(self) -> List[Dict[str, Any]]:
+    async def get_available_graphs(self) -> List[Dict[str, Any]]:
         """获取所有可用的知识图谱"""
-        response = self.session.get(f"{self.base_url}/graphs")
+        response = await self.client.get(f"{self.base_url}/graphs")
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
 
-    def get_entity_types(self, graph_id: str) -> List[str]:
+    async def get_entity_types(self, graph_id: str) -> List[str]:
         """获取图谱中的实体类型"""
-        response = self.session.get(f"{self.base_url}/graphs/{graph_id}/entity-types")
+        response = await self.client.get(
+            f"{self.base_url}/graphs/{graph_id}/entity-types"
+        )
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
 
-    def get_entities(
+    async def get_entities(
         self, graph_id: str, entity_type: str, limit: int = 100
     ) -> List[Dict[str, Any]]:
         """获取特定类型的实体"""
-        response = self.session.get(
+        response = await self.client.get(
             f"{self.base_url}/graphs/{graph_id}/entities",
             params={"entity_type": entity_type, "limit": limit, "offset": 0},
         )
         response.raise_for_status()
-        return response.json().get("entities", [])
+        return self._json(response).get("entities", [])
 
-    def get_entity_relations(
+    async def get_entity_relations(
         self, graph_id: str, entity_id: str
-    ) -> List[Dict[str, Any]]:
-        """获取实体的关系"""
-        response = self.session.get(
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """获取实体的关系，边下载边解析，不会一次性把整个响应读入内存"""
+        async with self.client.stream(
+            "GET",
             f"{self.base_url}/graphs/{graph_id}/entities/{entity_id}/relations",
             params={"direction": "BOTH"},
-        )
-        response.raise_for_status()
-        return response.json().get("relations", [])
+        ) as response:
+            response.raise_for_status()
+            # aiter_bytes返回的是已解压的内容
+            async for relation in ijson.items_async(
+                _AsyncByteReader(response.aiter_bytes()),
+                "relations.item",
+                use_float=True,
+            ):
+                yield relation
+
+    async def execute_query(
+        self, graph_id: str, query: str, retry: bool = False
+    ) -> Dict[str, Any]:
+        """
+        执行SPG DSL查询
 
-    def execute_query(self, graph_id: str, query: str) -> Dict[str, Any]:
-        """执行SPG DSL查询"""
-        response = self.session.post(
-            f"{self.base_url}/graphs/{graph_id}/query", json={"query": query}
+        Args:
+            graph_id: 知识图谱ID
+            query: SPG DSL查询语句
+            retry: 查询是只读的，遇到网关错误或连接中断时可以重试
+        """
+        response = await self.client.post(
+            f"{self.base_url}/graphs/{graph_id}/query",
+            json={"query": query},
+            extensions={"retry": retry},
         )
         response.raise_for_status()
-        return response.json()
+        return self._json(response)
+
+    async def get_relations_bulk(
+        self, graph_id: str, entity_ids: List[str]
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """一次DSL查询获取多个实体的关系，按实体ID分组"""
+        conditions = " OR ".join(
+            f'id(s) = "{entity_id}" OR id(o) = "{entity_id}"'
+            for entity_id in entity_ids
+        )
+        result = await self.execute_query(
+            graph_id,
+            f"MATCH (s)-[r]->(o) WHERE {conditions} RETURN s, r, o",
+            retry=True,
+        )
 
-    def visualize_entity_network(
+        by_entity = {entity_id: [] for entity_id in entity_ids}
+        for record in result.get("records", []):
+            if "r" not in record:
+                continue
+            source = record.get("s", {})
+            target = record.get("o", {})
+            relation = {"relation": record["r"], "source": source, "target": target}
+            for entity_id in {source.get("id"), target.get("id")}:
+                relations = by_entity.get(entity_id)
+                if relations is not None:
+                    relations.append(relation)
+        return by_entity
+
+    async def visualize_entity_network(
         self, graph_id: str, entity_type: str, limit: int = 20, depth: int = 1
     ):
         """
@@ -83,7 +282,7 @@ class GraphVisualizer:
         """
         # 获取实体
         print(f"获取{entity_type}类型的实体...")
-        entities = self.get_entities(graph_id, entity_type, limit)
+        entities = await self.get_entities(graph_id, entity_type, limit)
 
         if not entities:
             print(f"未找到{entity_type}类型的实体")
@@ -97,36 +296,222 @@ class GraphVisualizer:
         # 已处理的实体ID
         processed_ids = set()
 
-        # 递归获取实体及其关系
-        self._add_entities_with_relations(G, graph_id, entities, processed_ids, depth)
+        # 按层获取实体及其关系
+        await self._add_entities_with_relations(
+            G, graph_id, entities, processed_ids, depth
+        )
 
         # 可视化图形
         self._draw_graph(G, f"{entity_type}实体关系网络")
 
-    def _add_entities_with_relations(
-        self, G, graph_id, entities, processed_ids, depth, current_depth=0
-    ):
-        """递归添加实体及其关系到图中"""
-        if current_depth >= depth:
+    async def _fetch_relations(self, graph_id, entities, add_relation):
+        """
+        获取一批实体的关系，每条关系到达时调用add_relation(实体ID, 关系)
+
+        未过期的磁盘缓存直接使用；其余实体优先用一次DSL查询获取整批关系，
+        ID无法放入查询语句、查询失败或整批都没有匹配到关系时并发逐个流式获取；
+        整批没有匹配到关系而逐个获取到了关系时，之后不再使用批量查询
+        """
+        pending = []
+        for entity in entities:
+            relations = self._load_cached_relations(graph_id, entity["id"])
+            if relations is None:
+                pending.append(entity["id"])
+                continue
+            for relation in relations:
+                add_relation(entity["id"], relation)
+
+        bulk = [
+            entity_id
+            for entity_id in pending
+            if self._bulk_relations and _BULK_ID_PATTERN.match(entity_id)
+        ]
+        bulk_empty = False
+        if bulk:
+            try:
+                fetched = await self.get_relations_bulk(graph_id, bulk)
+            except httpx.HTTPError as e:
+                print(f"批量查询关系失败，改为逐个查询: {e}")
+            else:
+                if any(fetched.values()):
+                    # 批量查询的空结果无法和查询语句不被支持区分开，只在本次使用，不写入缓存
+                    for entity_id, relations in fetched.items():
+                        if relations:
+                            self._store_relations(graph_id, entity_id, relations)
+                        for relation in relations:
+                            add_relation(entity_id, relation)
+                    pending = [
+                        entity_id for entity_id in pending if entity_id not in fetched
+                    ]
+                else:
+                    print("批量查询没有匹配到任何关系，改为逐个查询")
+                    bulk_empty = True
+
+        pending = list(dict.fromkeys(pending))
+        counts = await asyncio.gather(
+            *(
+                self._stream_entity_relations(graph_id, entity_id, add_relation)
+                for entity_id in pending
+            )
+        )
+        if bulk_empty and self._bulk_relations:
+            bulk_ids = set(bulk)
+            if any(
+                count
+                for entity_id, count in zip(pending, counts)
+                if entity_id in bulk_ids
+            ):
+                print("批量查询结果与逐个查询不一致，本次运行不再使用批量查询")
+                self._bulk_relations = False
+
+    async def _stream_entity_relations(self, graph_id, entity_id, add_relation) -> int:
+        """
+        流式获取单个实体的全部关系，每条关系到达时即交给add_relation并写入缓存，
+        不在内存中保留整个关系列表
+
+        Returns:
+            int: 关系数量
+        """
+        count = 0
+        with self._relations_cache_writer(graph_id, entity_id) as write:
+            async for relation in self.get_entity_relations(graph_id, entity_id):
+                add_relation(entity_id, relation)
+                write(relation)
+                count += 1
+        return count
+
+    def _relations_cache_path(self, graph_id, entity_id) -> str:
+        """关系缓存文件路径，按服务地址、图谱和实体ID区分"""
+        key = hashlib.sha1(
+            f"{self.base_url}\0{graph_id}\0{entity_id}".encode("utf-8")
+        ).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json.gz")
+
+    def _load_cached_relations(self, graph_id, entity_id) -> Optional[List[Dict]]:
+        """读取未过期的关系缓存，没有可用缓存时返回None"""
+        if not self.cache_dir:
+            return None
+        path = self._relations_cache_path(graph_id, entity_id)
+        try:
+            if time.time() - os.path.getmtime(path) > RELATIONS_CACHE_TTL:
+                return None
+            with gzip.open(path, "rb") as f:
+                return orjson.loads(f.read())
+        except (OSError, EOFError, orjson.JSONDecodeError):
+            return None
+
+    def _store_relations(self, graph_id, entity_id, relations: List[Dict]):
+        """写入关系缓存，先写临时文件再替换，避免并发读到写了一半的文件"""
+        if not self.cache_dir:
             return
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                f.write(orjson.dumps(relations))
+            os.replace(tmp_path, self._relations_cache_path(graph_id, entity_id))
+        except OSError as e:
+            print(f"写入关系缓存失败: {e}")
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+
+    @contextlib.contextmanager
+    def _relations_cache_writer(self, graph_id, entity_id):
+        """
+        边接收边把关系写入缓存的临时文件，全部写完后才替换缓存文件
+
+        Yields:
+            write(relation)函数，未启用缓存或写入失败后不做任何事
+        """
+        if not self.cache_dir:
+            yield lambda relation: None
+            return
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        raw = os.fdopen(fd, "wb")
+        f = gzip.GzipFile(fileobj=raw, mode="wb")
+        separator = b"["
+        failed = False
 
+        def write(relation):
+            nonlocal separator, failed
+            if failed:
+                return
+            try:
+                f.write(separator + orjson.dumps(relation))
+            except OSError as e:
+                print(f"写入关系缓存失败: {e}")
+                failed = True
+            separator = b","
+
+        def discard():
+            with contextlib.suppress(OSError):
+                f.close()
+                raw.close()
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+
+        try:
+            yield write
+        except BaseException:
+            # 获取关系中途失败时不留下不完整的缓存
+            discard()
+            raise
+        if failed:
+            discard()
+            return
+        try:
+            f.write(b"[]" if separator == b"[" else b"]")
+            f.close()
+            raw.close()
+            os.replace(tmp_path, self._relations_cache_path(graph_id, entity_id))
+        except OSError as e:
+            print(f"写入关系缓存失败: {e}")
+            discard()
+
+    async def _add_entities_with_relations(
+        self, G, graph_id, entities, processed_ids, depth
+    ):
+        """
+        按层广度优先添加实体及其关系到图中，同一层实体的关系并发获取
+
+        图中的节点是按加入顺序编号的整数，实体ID只在这里映射一次，
+        之后的图操作都基于整数节点
+        """
+        node_index = {}
+
+        def index_of(entity_id) -> int:
+            return node_index.setdefault(entity_id, len(node_index))
+
+        # 实体加入待查询队列时即标记为已处理，每个实体只查询一次关系
+        frontier = {}
         for entity in entities:
             entity_id = entity.get("id")
             if not entity_id or entity_id in processed_ids:
                 continue
 
-            # 添加实体节点
             name = entity.get("name", entity_id)
             entity_type = entity.get("type", "Unknown")
-            G.add_node(entity_id, name=name, type=entity_type)
+            G.add_node(index_of(entity_id), name=name, type=entity_type)
             processed_ids.add(entity_id)
+            frontier[entity_id] = entity
 
-            # 获取关系
-            relations = self.get_entity_relations(graph_id, entity_id)
-            print(f"实体 {name} 有 {len(relations)} 个关系")
+        for current_depth in range(depth):
+            if not frontier:
+                break
 
-            related_entities = []
-            for relation in relations:
+            # 本层实体按批查询关系，各批在事件循环上并发执行，关系到达时即写入图中
+            level = list(frontier.values())
+            batches = [
+                level[i : i + BULK_RELATIONS_BATCH_SIZE]
+                for i in range(0, len(level), BULK_RELATIONS_BATCH_SIZE)
+            ]
+            # 最后一层的邻居不会再被展开，不必加入下一层
+            expand = current_depth + 1 < depth
+            next_frontier = {}
+            relation_counts = dict.fromkeys(frontier, 0)
+
+            def add_relation(entity_id, relation):
+                relation_counts[entity_id] += 1
                 rel = relation.get("relation", {})
                 source = relation.get("source", {})
                 target = relation.get("target", {})
@@ -135,38 +520,75 @@ class GraphVisualizer:
                 target_id = target.get("id")
 
                 if not source_id or not target_id:
-                    continue
+                    return
 
                 # 添加关系边
-                if source_id == entity_id:
-                    other_entity = target
-                    G.add_node(
-                        target_id,
-                        name=target.get("name", target_id),
-                        type=target.get("type", "Unknown"),
-                    )
-                    G.add_edge(source_id, target_id, type=rel.get("type", "Unknown"))
-                    related_entities.append(target)
-                else:
-                    other_entity = source
-                    G.add_node(
-                        source_id,
-                        name=source.get("name", source_id),
-                        type=source.get("type", "Unknown"),
-                    )
-                    G.add_edge(source_id, target_id, type=rel.get("type", "Unknown"))
-                    related_entities.append(source)
-
-            # 递归处理相关实体
-            if related_entities and current_depth + 1 < depth:
-                self._add_entities_with_relations(
-                    G,
-                    graph_id,
-                    related_entities,
-                    processed_ids,
-                    depth,
-                    current_depth + 1,
+                other_entity = target if source_id == entity_id else source
+                other_id = other_entity["id"]
+                G.add_node(
+                    index_of(other_id),
+                    name=other_entity.get("name", other_id),
+                    type=other_entity.get("type", "Unknown"),
                 )
+                G.add_edge(
+                    index_of(source_id),
+                    index_of(target_id),
+                    type=rel.get("type", "Unknown"),
+                )
+
+                # 多个父节点关联到同一实体时，只加入下一层一次
+                if expand and other_id not in processed_ids:
+                    processed_ids.add(other_id)
+                    next_frontier[other_id] = other_entity
+
+            await asyncio.gather(
+                *(
+                    self._fetch_relations(graph_id, batch, add_relation)
+                    for batch in batches
+                )
+            )
+            for entity_id, entity in frontier.items():
+                print(
+                    f"实体 {entity.get('name', entity_id)} 有 {relation_counts[entity_id]} 个关系"
+                )
+
+            frontier = next_frontier
+
+    @staticmethod
+    def _shortest_path_lengths(G) -> Dict[Any, Dict[Any, float]]:
+        """
+        用SciPy的稀疏图算法一次计算全源最短路径长度，供Kamada-Kawai布局使用
+
+        不可达的节点对不写入结果，由networkx按默认的远距离处理
+        """
+        from scipy.sparse.csgraph import shortest_path
+
+        nodes = list(G.nodes)
+        matrix = shortest_path(
+            nx.to_scipy_sparse_array(G, nodelist=nodes, weight=None),
+            method="D",
+            directed=False,
+            unweighted=True,
+        )
+        return {
+            u: {v: d for v, d in zip(nodes, row.tolist()) if d != float("inf")}
+            for u, row in zip(nodes, matrix)
+        }
+
+    @staticmethod
+    def _graph_to_soa(G, pos) -> "_GraphArrays":
+        """一次遍历节点，把ID、名称、类型和布局坐标分别收集为数组"""
+        num_nodes = G.number_of_nodes()
+        ids = np.empty(num_nodes, dtype=object)
+        names = np.empty(num_nodes, dtype=object)
+        types = np.empty(num_nodes, dtype=object)
+        positions = np.empty((num_nodes, 2), dtype=np.float32)
+        for i, (node, data) in enumerate(G.nodes(data=True)):
+            ids[i] = node
+            names[i] = data.get("name", node)
+            types[i] = str(data.get("type", "Unknown"))
+            positions[i] = pos[node]
+        return _GraphArrays(ids=ids, names=names, types=types, positions=positions)
 
     def _draw_graph(self, G, title):
         """绘制图形"""
@@ -179,99 +601,179 @@ class GraphVisualizer:
             print("图中没有节点，无法绘制")
             return
 
-        # 设置图形大小
-        plt.figure(figsize=(12, 10))
-
         # 根据节点数量选择不同的布局算法
         if num_nodes <= 50:
             pos = nx.spring_layout(G, seed=42)  # 小图使用弹簧布局
+        elif num_nodes <= KAMADA_KAWAI_MAX_NODES:
+            # 中等规模使用Kamada-Kawai布局
+            pos = nx.kamada_kawai_layout(G, dist=self._shortest_path_lengths(G))
         else:
-            pos = nx.kamada_kawai_layout(G)  # 大图使用Kamada-Kawai布局
+            # Kamada-Kawai需要全源最短路径和n×n的代价矩阵，大图上是最慢的一步，
+            # 改用迭代次数受限的弹簧布局
+            pos = nx.spring_layout(G, seed=42, iterations=50)
+
+        # 节点数据转为按列存储的数组，颜色按类型一次性分配
+        arrays = self._graph_to_soa(G, pos)
+        type_names, type_idx = np.unique(arrays.types, return_inverse=True)
+        type_colors = _TYPE_PALETTE[np.arange(len(type_names)) % len(_TYPE_PALETTE)]
+        output_file = f"{title.replace(' ', '_')}.png"
 
-        # 获取节点类型
-        node_types = {
-            node: data.get("type", "Unknown") for node, data in G.nodes(data=True)
-        }
-        unique_types = set(node_types.values())
-
-        # 为每种类型分配不同的颜色
-        color_map = {}
-        colors = plt.cm.tab10.colors
-        for i, t in enumerate(unique_types):
-            color_map[t] = colors[i % len(colors)]
-
-        # 绘制节点
-        for node_type in unique_types:
-            nodes = [
-                node
-                for node, data in G.nodes(data=True)
-                if data.get("type") == node_type
-            ]
-            nx.draw_networkx_nodes(
-                G,
-                pos,
-                nodelist=nodes,
-                node_color=[color_map[node_type]] * len(nodes),
-                node_size=300,
-                alpha=0.8,
-                label=node_type,
-            )
+        if self.renderer == "datashader" and num_nodes > DATASHADER_MIN_NODES:
+            self._render_datashader(G, arrays, type_names, type_colors, output_file)
+            return
 
-        # 绘制边
-        nx.draw_networkx_edges(G, pos, alpha=0.5)
+        fig, ax = self._get_axes()
+
+        # 所有节点一次绘制，图例按类型单独构造
+        ax.scatter(
+            arrays.positions[:, 0],
+            arrays.positions[:, 1],
+            c=type_colors[type_idx],
+            s=300,
+            alpha=0.8,
+            zorder=2,
+            rasterized=True,
+        )
+        legend_handles = [
+            Patch(color=color, alpha=0.8, label=node_type)
+            for node_type, color in zip(type_names, type_colors)
+        ]
+
+        # 所有边作为一个LineCollection一次绘制
+        if num_edges:
+            segments = arrays.positions[_edge_array(G)]
+            ax.add_collection(
+                LineCollection(
+                    segments,
+                    colors="k",
+                    linewidths=1.0,
+                    alpha=0.5,
+                    zorder=1,
+                    rasterized=True,
+                )
+            )
 
-        # 绘制标签
-        labels = {node: data.get("name", node) for node, data in G.nodes(data=True)}
-        nx.draw_networkx_labels(G, pos, labels, font_size=8, font_family="sans-serif")
+        # 坐标范围直接由布局坐标确定，不用tight_layout逐个测量所有图元的边界
+        lo = arrays.positions.min(axis=0)
+        hi = arrays.positions.max(axis=0)
+        pad = np.maximum(0.05 * (hi - lo), 0.1)
+        ax.set_xlim(lo[0] - pad[0], hi[0] + pad[0])
+        ax.set_ylim(lo[1] - pad[1], hi[1] + pad[1])
+
+        # 绘制标签，节点过多时标签既看不清又要为每个标签创建一个文本对象，直接跳过
+        if num_nodes <= MAX_LABELED_NODES:
+            labels = dict(zip(arrays.ids, arrays.names))
+            nx.draw_networkx_labels(
+                G, pos, labels, font_size=8, font_family="sans-serif", ax=ax
+            )
 
-        plt.title(title)
-        plt.legend()
-        plt.axis("off")
-        plt.tight_layout()
+        ax.set_title(title)
+        ax.legend(handles=legend_handles)
+        ax.set_axis_off()
+        # 固定的页边距，效果接近tight_layout
+        fig.subplots_adjust(left=0.02, right=0.98, bottom=0.02, top=0.95)
 
         # 保存图形
-        output_file = f"{title.replace(' ', '_')}.png"
-        plt.savefig(output_file, dpi=300)
+        fig.savefig(output_file, dpi=self.dpi)
         print(f"图形已保存至 {output_file}")
 
-        # 显示图形
-        plt.show()
+        # 显示图形，Agg后端无法显示
+        if self.show and matplotlib.get_backend().lower() != "agg":
+            plt.show()
 
-    def visualize_custom_query(
-        self, graph_id: str, query: str, title: str = "自定义查询结果"
-    ):
+    def _get_axes(self):
+        """返回清空后的Figure和绘图区，显示窗口被关闭后重新创建Figure"""
+        fig = self._figure
+        if fig is None or not plt.fignum_exists(fig.number):
+            fig = self._figure = plt.figure(figsize=(12, 10))
+        else:
+            fig.clear()
+        return fig, fig.add_subplot()
+
+    @staticmethod
+    def _render_datashader(G, arrays, type_names, type_colors, output_file):
         """
-        通过自定义查询可视化图形
+        用datashader把节点和边聚合到像素网格上直接输出PNG
 
-        Args:
-            graph_id: 知识图谱ID
-            query: SPG DSL查询语句
-            title: 图形标题
+        耗时与像素数相关而与节点、边的数量基本无关，用于matplotlib逐个创建图元画不动的大图，
+        不绘制标签和图例
         """
-        # 执行查询
-        print("执行查询...")
-        result = self.execute_query(graph_id, query)
+        import datashader as ds
+        import datashader.transfer_functions as tf
+        import pandas as pd
+        from datashader.utils import export_image
+        from matplotlib.colors import to_hex
+
+        lo = arrays.positions.min(axis=0)
+        hi = arrays.positions.max(axis=0)
+        pad = np.maximum(0.05 * (hi - lo), 0.1)
+        canvas = ds.Canvas(
+            plot_width=DATASHADER_WIDTH,
+            plot_height=DATASHADER_HEIGHT,
+            x_range=(lo[0] - pad[0], hi[0] + pad[0]),
+            y_range=(lo[1] - pad[1], hi[1] + pad[1]),
+        )
 
-        records = result.get("records", [])
-        if not records:
-            print("查询没有返回结果")
-            return
+        nodes_df = pd.DataFrame(
+            {
+                "x": arrays.positions[:, 0],
+                "y": arrays.positions[:, 1],
+                "type": pd.Categorical(arrays.types, categories=type_names),
+            }
+        )
+        nodes_img = tf.spread(
+            tf.shade(
+                canvas.points(nodes_df, "x", "y", agg=ds.count_cat("type")),
+                color_key={t: to_hex(c) for t, c in zip(type_names, type_colors)},
+                min_alpha=255,
+            ),
+            px=2,
+        )
 
-        print(f"查询返回了 {len(records)} 条记录")
+        image = nodes_img
+        if G.number_of_edges():
+            endpoints = _edge_array(G)
+            sources = arrays.positions[endpoints[:, 0]]
+            targets = arrays.positions[endpoints[:, 1]]
+            edges_df = pd.DataFrame(
+                {
+                    "x0": sources[:, 0],
+                    "y0": sources[:, 1],
+                    "x1": targets[:, 0],
+                    "y1": targets[:, 1],
+                }
+            )
+            edges_img = tf.shade(
+                canvas.line(edges_df, x=["x0", "x1"], y=["y0", "y1"], axis=1),
+                cmap=["lightgray", "black"],
+                how="log",
+            )
+            image = tf.stack(edges_img, nodes_img)
 
-        # 创建NetworkX图
-        G = nx.Graph()
+        export_image(image, output_file[: -len(".png")], fmt=".png", background="white")
+        print(f"图形已保存至 {output_file}")
+
+    @staticmethod
+    def _build_query_graph(records: List[Dict[str, Any]]) -> nx.Graph:
+        """
+        将查询记录构造成图
 
-        # 处理查询结果
+        记录中带id的字段作为实体节点；同时带type和properties的字段视为关系，
+        在该记录的前两个实体之间连边。节点和边先收集起来再批量写入，
+        节点是按首次出现顺序编号的整数
+        """
+        node_index = {}
+        nodes = []
+        edges = []
         for record in records:
             # 查找记录中的实体和关系
-            entities = {}
+            entities = []
             relation = None
 
-            for key, value in record.items():
+            for value in record.values():
                 if isinstance(value, dict) and "id" in value:
                     # 这是一个实体
-                    entities[key] = value
+                    entities.append(value)
                 elif (
                     isinstance(value, dict)
                     and "type" in value
@@ -280,23 +782,61 @@ class GraphVisualizer:
                     # 这可能是一个关系
                     relation = value
 
-            # 添加实体节点
-            for key, entity in entities.items():
+            # 实体节点，同一实体出现多次时后出现的属性覆盖先出现的
+            entity_nodes = []
+            for entity in entities:
                 entity_id = entity.get("id")
-                name = entity.get("name", entity_id)
-                entity_type = entity.get("type", "Unknown")
-                G.add_node(entity_id, name=name, type=entity_type)
-
-            # 如果有关系，添加边
-            if relation and len(entities) >= 2:
-                # 找出源和目标
-                entity_ids = [entity.get("id") for entity in entities.values()]
-                if len(entity_ids) >= 2:
-                    G.add_edge(
-                        entity_ids[0],
-                        entity_ids[1],
-                        type=relation.get("type", "Unknown"),
+                node = node_index.setdefault(entity_id, len(node_index))
+                entity_nodes.append(node)
+                nodes.append(
+                    (
+                        node,
+                        {
+                            "name": entity.get("name", entity_id),
+                            "type": entity.get("type", "Unknown"),
+                        },
+                    )
+                )
+
+            # 如果有关系，在前两个实体之间连边
+            if relation and len(entity_nodes) >= 2:
+                edges.append(
+                    (
+                        entity_nodes[0],
+                        entity_nodes[1],
+                        {"type": relation.get("type", "Unknown")},
                     )
+                )
+
+        G = nx.Graph()
+        G.add_nodes_from(nodes)
+        G.add_edges_from(edges)
+        return G
+
+    async def visualize_custom_query(
+        self, graph_id: str, query: str, title: str = "自定义查询结果"
+    ):
+        """
+        通过自定义查询可视化图形
+
+        Args:
+            graph_id: 知识图谱ID
+            query: SPG DSL查询语句
+            title: 图形标题
+        """
+        # 执行查询
+        print("执行查询...")
+        result = await self.execute_query(graph_id, query)
+
+        records = result.get("records", [])
+        if not records:
+            print("查询没有返回结果")
+            return
+
+        print(f"查询返回了 {len(records)} 条记录")
+
+        # 创建NetworkX图
+        G = self._build_query_graph(records)
 
         # 可视化图形
         self._draw_graph(G, title)
@@ -337,21 +877,46 @@ def main():
     parser.add_argument(
         "--list-types", action="store_true", help="列出指定图谱中的实体类型"
     )
+    parser.add_argument("--dpi", type=int, default=100, help="保存图片的分辨率")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="不使用实体关系的磁盘缓存"
+    )
+    parser.add_argument(
+        "--renderer",
+        type=str,
+        choices=["matplotlib", "datashader"],
+        default="matplotlib",
+        help=f"绘图方式：datashader仅在节点数超过{DATASHADER_MIN_NODES}时生效",
+    )
+    parser.add_argument(
+        "--no-show", action="store_true", help="只保存图片，不打开窗口显示"
+    )
 
     args = parser.parse_args()
+    asyncio.run(run(args))
+
 
-    visualizer = GraphVisualizer(args.url)
+async def run(args):
+    """按命令行参数执行可视化"""
+
+    visualizer = GraphVisualizer(
+        args.url,
+        dpi=args.dpi,
+        cache_dir=None if args.no_cache else RELATIONS_CACHE_DIR,
+        renderer=args.renderer,
+        show=not args.no_show,
+    )
 
     try:
         if args.list_graphs:
-            graphs = visualizer.get_available_graphs()
+            graphs = await visualizer.get_available_graphs()
             print("可用的知识图谱:")
             for graph in graphs:
                 print(f"  名称: {graph['name']}, ID: {graph['id']}")
             return
 
         if args.list_types and args.graph_id:
-            types = visualizer.get_entity_types(args.graph_id)
+            types = await visualizer.get_entity_types(args.graph_id)
             print(f"知识图谱 {args.graph_id} 中的实体类型:")
             for t in types:
                 print(f"  {t}")
@@ -361,19 +926,21 @@ def main():
             if not args.entity_type:
                 print("错误：entity模式下必须指定--entity-type参数")
                 return
-            visualizer.visualize_entity_network(
+            await visualizer.visualize_entity_network(
                 args.graph_id, args.entity_type, args.limit, args.depth
             )
         elif args.mode == "query":
             if not args.query:
                 print("错误：query模式下必须指定--query参数")
                 return
-            visualizer.visualize_custom_query(args.graph_id, args.query)
+            await visualizer.visualize_custom_query(args.graph_id, args.query)
 
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"API请求错误: {e}")
     except Exception as e:
         print(f"错误: {e}")
+    finally:
+        await visualizer.aclose()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,101 @@
+import os
+import random
+import sys
+
+import pytest
+
+nx = pytest.importorskip("networkx")
+for module in ("httpx", "ijson", "matplotlib", "numpy", "orjson"):
+    pytest.importorskip(module)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "test_scripts"))
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+from graph_visualizer import GraphVisualizer  # noqa: E402
+
+
+def _reference_graph(records):
+    """重构前逐条记录处理的实现，节点为原始实体ID"""
+    G = nx.Graph()
+    for record in records:
+        entities = {}
+        relation = None
+        for key, value in record.items():
+            if isinstance(value, dict) and "id" in value:
+                entities[key] = value
+            elif isinstance(value, dict) and "type" in value and "properties" in value:
+                relation = value
+
+        for entity in entities.values():
+            entity_id = entity.get("id")
+            G.add_node(
+                entity_id,
+                name=entity.get("name", entity_id),
+                type=entity.get("type", "Unknown"),
+            )
+
+        if relation and len(entities) >= 2:
+            entity_ids = [entity.get("id") for entity in entities.values()]
+            G.add_edge(
+                entity_ids[0], entity_ids[1], type=relation.get("type", "Unknown")
+            )
+    return G
+
+
+def _random_value(rng):
+    roll = rng.random()
+    if roll < 0.45:
+        entity = {"id": f"e{rng.randint(0, 6)}"}
+        if rng.random() < 0.6:
+            entity["name"] = rng.choice([f"n{rng.randint(0, 3)}", None])
+        if rng.random() < 0.6:
+            entity["type"] = rng.choice(["Person", "Company"])
+        return entity
+    if roll < 0.75:
+        return {"type": rng.choice(["R1", "R2", None]), "properties": {"w": 1}}
+    if roll < 0.85:
+        return {}
+    return rng.choice(["scalar", 1, None])
+
+
+def _random_records(rng):
+    keys = ["s", "r", "o", "s.id", "o.id", "x"]
+    records = []
+    for _ in range(rng.randint(1, 8)):
+        record_keys = rng.sample(keys, rng.randint(0, len(keys)))
+        records.append({key: _random_value(rng) for key in record_keys})
+    return records
+
+
+def _assert_same_graph(G, expected):
+    ids = list(expected.nodes)
+    assert list(G.nodes) == list(range(len(ids)))
+    assert [data for _, data in G.nodes(data=True)] == [
+        data for _, data in expected.nodes(data=True)
+    ]
+    assert {
+        (frozenset((ids[u], ids[v])), data["type"]) for u, v, data in G.edges(data=True)
+    } == {(frozenset((u, v)), data["type"]) for u, v, data in expected.edges(data=True)}
+
+
+def test_build_query_graph_matches_record_loop():
+    rng = random.Random(0)
+    for _ in range(500):
+        records = _random_records(rng)
+        _assert_same_graph(
+            GraphVisualizer._build_query_graph(records), _reference_graph(records)
+        )
+
+
+def test_build_query_graph_flattened_keys():
+    records = [
+        {"s.id": "a", "o.id": "b"},
+        {
+            "s": {"id": "a", "name": "A", "type": "Person"},
+            "r": {"type": "knows", "properties": {}},
+            "o": {"id": "b"},
+        },
+    ]
+    G = GraphVisualizer._build_query_graph(records)
+    _assert_same_graph(G, _reference_graph(records))
+    assert G.number_of_edges() == 1